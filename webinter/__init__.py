@@ -1 +1,2 @@
-from webinter.elements import WebI, Element, MediaElement, DrawingBoard, Group, Namespace
\ No newline at end of file
+from webinter.elements import WebI, Element, MediaElement, DrawingBoard, Table, Chart, Canvas, Group, Namespace
+from webinter.server import read_chunks
\ No newline at end of file
@@ -1,15 +1,24 @@
 from .html_builder import HTMLBuilder
 from .server import Server
-from PIL import Image
-from io import BytesIO
+from . import media
+from PIL import Image, ImageColor
 import uuid
 import numpy as np
-from scipy.io import wavfile
 import asyncio
 import functools
-from collections.abc import Sequence
+import bisect
+import re
+import json
+import struct
+from collections import OrderedDict
+from collections.abc import Sequence, Iterable
+from concurrent.futures import ProcessPoolExecutor
 
 class Element:
+    # Input types whose value can be kept in sync with the server
+    MIRROR_TYPES = {"text", "number", "range", "checkbox", "select", "color", "textarea"}
+    SERVER_EVENTS = {"upload_progress"} # emitted by the server, not by the browser
+
     def __init__(self, webi, element_type, attr, html_tag, html_input_type):
         self.id = uuid.uuid4().hex
         self.webi = webi
@@ -22,7 +31,11 @@ class Element:
         }
         self._group = None
         self._style = {}
-        self._value_response = asyncio.Event() # waits for a value response
+        self._classes = [] # names of the style classes applied to the element
+        self._mirrored = False # a value has been pushed by the client
+        self._mirror_value = None
+        self._decode = False # decode uploaded images to arrays
+        self.update_rate = None # maximum updates per second, None uses the rate of the WebI instance
     
     def _async(default=None):
         def decorator(f):
@@ -53,28 +66,35 @@ class Element:
         # Return None if the app hasn't been started yet
         if not self.webi.server.namespaces[self.webi.name].connected:
             return None
-            
-        # Call client
-        await self.webi.server._emit(self.webi.name, "get_value", self.id)
 
-        # Wait for client to return a value
-        await self._value_response.wait()
-        value = self._value_response.value
+        # Mirrored inputs always hold their latest value
+        if self._mirrored:
+            return self._mirror_value
+            
+        # Call client and wait for it to return the value
+        value = await self.webi._request("get_value", self.id)
+        if self._decode and value:
+            await self._decode_files(value)
+        return value
 
-        # Reset the waiting variable
-        self._value_response.clear()
-        self._value_response.value = None
+    async def _decode_files(self, files):
+        async def decode(file):
+            data = await asyncio.to_thread(media.read, file["file"])
+            file["file"].seek(0)
+            file["array"] = await self.webi.server.run_in_executor(
+                self.webi.server.encoding_executor, media.decode_image, data
+            )
 
-        return value
+        await asyncio.gather(*(decode(file) for file in files if file["type"] == "image"))
     
     @_async()
     async def _create(self):
-        # Create html and add to server
-        html = HTMLBuilder.create_html_element(
-            **self._html_builder_args, **self.attr
-        )
+        # The html is rendered by the namespace, together with the other elements of a batch
+        args = self._html_builder_args
+        HTMLBuilder.builder(args["tag_name"], args["type"]) # unsupported types fail right away
         await self.webi.server._emit(
-            self.webi.name, "create_element", self.id, html
+            self.webi.name, "create_element", self.id,
+            (args["tag_name"], self.id, {"type": args["type"], **self.attr})
         )
         self.webi.elements[self.id] = self
 
@@ -89,7 +109,12 @@ class Element:
         return self
     
     # decorator
-    def on(self, event, *, _async=None):
+    def on(self, event, *, executor=None, throttle_ms=None, debounce_ms=None, latest_only=True, _async=None):
+        # Let the browser coalesce bursts of events
+        options = None
+        if throttle_ms is not None or debounce_ms is not None:
+            options = {"throttle_ms": throttle_ms, "debounce_ms": debounce_ms, "latest_only": latest_only}
+
         def register(f):
             # create empty dict for event if necessary
             if event not in self.webi.handlers:
@@ -97,20 +122,27 @@ class Element:
             if self.id not in self.webi.handlers[event]:
                 self.webi.handlers[event][self.id] = {}
 
-            # register event (only the first time)
-            if len(self.webi.handlers[event][self.id]) == 0:
+            # register event (only the first time or to change its options), server side events don't exist in the browser
+            if (len(self.webi.handlers[event][self.id]) == 0 or options is not None) and event not in self.SERVER_EVENTS:
                 _a = _async if _async is not None else (asyncio.get_event_loop_policy()._local._loop is not None)
                 if _a:
                     loop = asyncio.get_running_loop()
                     loop.create_task(
-                        self.webi.server._emit(self.webi.name, "register_event", self.id, event)
+                        self.webi.server._emit(self.webi.name, "register_event", self.id, event, options)
                     )
                 else:
-                    asyncio.run(self.webi.server._emit(self.webi.name, "register_event", self.id, event))
+                    asyncio.run(self.webi.server._emit(self.webi.name, "register_event", self.id, event, options))
 
             # set decorated function as handler
             f.id = uuid.uuid4().hex
-            self.webi.handlers[event][self.id][f.id] = f
+            handler = f
+            if executor is not None:
+                # f is a synchronous function, elements can't be sent to other processes
+                async def handler(element, value):
+                    process = executor == "process" or isinstance(executor, ProcessPoolExecutor)
+                    arg = element.id if process else element
+                    return await self.webi.server.run_in_executor(executor, f, arg, value)
+            self.webi.handlers[event][self.id][f.id] = handler
 
             return f
         return register
@@ -123,7 +155,7 @@ class Element:
 
         del self.webi.handlers[event][self.id][handler.id]
 
-        if len(self.webi.handlers[event][self.id]) == 0:
+        if len(self.webi.handlers[event][self.id]) == 0 and event not in self.SERVER_EVENTS:
             await self.webi.server._emit(self.webi.name, "remove_event", self.id, event)
     
     @_async()
@@ -133,11 +165,13 @@ class Element:
     @_async()
     async def remove(self):
         self.webi.elements.pop(self.id, None) # remove from elements
+        self.webi.server.media_sources.pop(self.id, None)
         for event in self.webi.handlers.keys(): # remove from all handlers
             self.webi.handlers[event].pop(self.id, None)
         if self._group is not None: # remove from group
-            self.webi.groups[self._group]._members.remove(self.id)
+            del self.webi.groups[self._group]._members[self.id]
             self._group = None
+            self.webi._tree_version += 1
         # remove (server side)
         await self.webi.server._emit(self.webi.name, "remove_element", self.id)
     
@@ -147,7 +181,7 @@ class Element:
         attr.pop("src", None) # Can not change the src (of a media element)
         attr.pop("style", None) # Should not change the style
         self.attr.update(attr)
-        await self.webi.server._emit(self.webi.name, "update_attributes", self.id, attr)
+        await self._update("update_attributes", attr)
     
     @_async()
     async def remove_attr(self, attribute_names):
@@ -156,28 +190,49 @@ class Element:
             if name == "type" or name == "src" or name == "style":
                 continue
             self.attr.pop(name)
-        await self.webi.server._emit(self.webi.name, "remove_attributes", self.id, attribute_names)
+        await self._update("remove_attributes", attribute_names)
     
     @_async()
     async def update_style(self, style, *, rule="<self>"):
-        if rule not in self._style:
-            self._style[rule] = {}
-        self._style[rule].update(style)
-        await self.webi.server._emit(self.webi.name, "update_style", self.id, self._style[rule], rule)
+        changes = _style_changes(self._style, rule, style)
+        if changes:
+            await self._update("update_style", changes, rule)
 
     @_async()
     async def remove_style(self, style_names, *, rule="<self>"):
-        for name in style_names:
-            self._style[rule].pop(name)
-        await self.webi.server._emit(self.webi.name, "update_style", self.id, self._style[rule], rule)
+        changes = _style_removals(self._style, rule, style_names)
+        if changes:
+            await self._update("update_style", changes, rule)
+
+    @_async()
+    async def add_class(self, name):
+        _check_class_name(name)
+        if name not in self._classes:
+            self._classes.append(name)
+            await self.webi.server._emit(self.webi.name, "add_class", self.id, name)
+
+    @_async()
+    async def remove_class(self, name):
+        if name in self._classes:
+            self._classes.remove(name)
+            await self.webi.server._emit(self.webi.name, "remove_class", self.id, name)
+
+    async def _update(self, event, *data):
+        rate = self.update_rate if self.update_rate is not None else self.webi.update_rate
+        if rate:
+            await self.webi.server.namespaces[self.webi.name].emit_limited(rate, event, self.id, *data)
+        else:
+            await self.webi.server._emit(self.webi.name, event, self.id, *data)
 
 
 class MediaElement(Element):
-    def __init__(self, webi, element_type, attr, html_tag, html_input_type, src, format):
+    def __init__(self, webi, element_type, attr, html_tag, html_input_type, src, format, encoding=None):
         super().__init__(webi, element_type, attr, html_tag, html_input_type)
         self.src = src
         self.attr.pop("src", None)
         self.format = format
+        self.encoding = encoding or {}
+        self._last_frame = None # last array sent by update_src
     
     @Element._async()
     async def _create(self):
@@ -185,45 +240,153 @@ class MediaElement(Element):
         await self.change_src(self.src, self.format, _async=True)
     
     @Element._async()
-    async def change_src(self, src, format):
+    async def change_src(self, src, format, encoding=None):
         self.src = src
+        self.format = format
+        self._last_frame = None
+        if encoding is not None:
+            self.encoding = encoding
         if src is None: return
-        file = {}
-        if self.type == "image":
-            if isinstance(self.src, (np.ndarray, Image.Image)):
-                if not isinstance(self.src, Image.Image):
-                    # Create image from array (of type uint8)
-                    img_src = Image.fromarray(self.src.astype(np.uint8))
-
-                # Save image object and read data
-                buffer = BytesIO()
-                img_src.save(buffer, format=format.upper())
-                buffer.seek(0)
-                file["src"] = buffer
-
-            else:
-                file["src"] = self.src
-            
-        elif self.type == "audio":
-            if isinstance(self.src, np.ndarray):
-                assert format.upper() == "WAV"
+        file = await self._encode(src, format)
+        await self.webi.server._emit(self.webi.name, 
+            "change_src", self.id, file["mimetype"], await self._store(file)
+        )
+
+    async def _store(self, file):
+        server = self.webi.server
+
+        # Small files are sent along with the message
+        size = media.size(file["src"])
+        if size is not None and size <= server.inline_threshold:
+            if isinstance(file["src"], bytes):
+                return file["src"]
+            return await server.run_in_executor("thread", media.read, file["src"])
+
+        # Audio and video are streamed from a persistent url
+        if self.type in ("audio", "video"):
+            server.media_sources[self.id] = file
+            return f"/media/{self.id}?v={uuid.uuid4().hex[:8]}"
+
+        # Anything else is served from the media cache
+        digest = file.get("digest") or await server.store(file["src"], file["mimetype"])
+        return f"/get_file?id={digest}"
+
+    @Element._async()
+    async def update_src(self, src, tile_size=64):
+        server = self.webi.server
+        previous = self._last_frame
+        full = (
+            self.type != "image" or not isinstance(src, np.ndarray)
+            or previous is None or previous.shape != src.shape
+            or not server.namespaces[self.webi.name].connected
+        )
+        # Comparing and copying large frames would block the event loop
+        tiles = [] if full else await server.run_in_executor("thread", media.dirty_tiles, previous, src, tile_size)
+
+        # Send the whole image if most of it changed anyway
+        if full or len(tiles) * tile_size ** 2 > src.shape[0] * src.shape[1] / 2:
+            await self.change_src(src, self.format, _async=True)
+            if isinstance(src, np.ndarray):
+                self._last_frame = await server.run_in_executor("thread", src.copy)
+            return
 
-                buffer = BytesIO()
-                wavfile.write(buffer, None, self.src)
-                buffer.seek(0)
-                file["src"] = buffer
+        self.src = src
+        self._last_frame = await server.run_in_executor("thread", src.copy)
+        if not tiles:
+            return
 
-            else:
-                file["src"] = self.src
+        encoded = await server.run_in_executor(
+            server.encoding_executor, media.encode_tiles, src, tiles, tile_size, self.format, self.encoding
+        )
+        await server._emit(self.webi.name,
+            "patch_src", self.id, media.mimetype(self.type, self.format), encoded
+        )
+
+    async def _encode(self, src, format):
+        server = self.webi.server
+        file = {"mimetype": media.mimetype(self.type, format)}
+        if self.type == "image" and isinstance(src, (np.ndarray, Image.Image)):
+            encode = (media.encode_image, src, format, self.encoding)
             
-        else:
-            file["src"] = self.src
+        elif self.type == "audio" and isinstance(src, np.ndarray):
+            assert format.upper() == "WAV"
+            encode = (media.encode_audio, src)
             
-        file["mimetype"] = f"{self.type}/{format.lower()}"
-        self.webi.server.file_storage[self.id] = file
-        await self.webi.server._emit(self.webi.name, 
-            "change_src", self.id, file["mimetype"]
-        )
+        else:
+            file["src"] = src
+            return file
+
+        # Identical sources don't have to be encoded again
+        options = self.encoding if self.type == "image" else {}
+        key = await server.run_in_executor("thread", media.source_key, src, format, options)
+        digest = server.file_storage.lookup(key)
+        if digest is None:
+            # Encode off the event loop
+            buffer = await server.run_in_executor(server.encoding_executor, *encode)
+            digest = await server.store(buffer.getvalue(), file["mimetype"], key)
+
+        file["src"] = server.file_storage.get(digest)["src"]
+        file["digest"] = digest
+        return file
+
+    @Element._async()
+    async def stream(self, frames, max_fps=None, format=None):
+        format = format or self.format
+        loop = asyncio.get_running_loop()
+        self.stream_stats = {"delivered": 0, "dropped": 0}
+
+        # Only the latest frame is kept, older ones are dropped
+        latest = []
+        new_frame = asyncio.Event()
+        finished = False
+
+        async def receive():
+            nonlocal finished
+            try:
+                async for frame in frames:
+                    if latest:
+                        latest.pop()
+                        self.stream_stats["dropped"] += 1
+                    latest.append(frame)
+                    new_frame.set()
+            finally:
+                finished = True
+                new_frame.set()
+
+        receiver = loop.create_task(receive())
+        try:
+            while True:
+                if not latest:
+                    if finished:
+                        break
+                    await new_frame.wait()
+                    new_frame.clear()
+                    continue
+
+                frame = latest.pop()
+                self.src = frame
+                self.format = format
+                if not self.webi.server.namespaces[self.webi.name].connected:
+                    self.stream_stats["dropped"] += 1
+                    continue
+
+                # Send the frame and wait until the client has displayed it
+                started = loop.time()
+                file = await self._encode(frame, format)
+                await self.webi._request("change_src", self.id, file["mimetype"], await self._store(file))
+                # The client may have disconnected in the meantime
+                if self.webi.server.namespaces[self.webi.name].connected:
+                    self.stream_stats["delivered"] += 1
+                else:
+                    self.stream_stats["dropped"] += 1
+
+                if max_fps:
+                    await asyncio.sleep(max(0, 1 / max_fps - (loop.time() - started)))
+        finally:
+            receiver.cancel()
+
+        receiver.result() # raise errors of the frame iterator
+        return self.stream_stats
 
 class DrawingBoard(Element):
     def __init__(self, webi, element_type, attr, html_tag, html_input_type):
@@ -255,23 +418,214 @@ class DrawingBoard(Element):
         if not self.webi.server.namespaces[self.webi.name].connected:
             return None
             
-        await self.webi.server._emit(self.webi.name, "get_drawing_board", self.id, res)
+        return await self.webi._request("get_drawing_board", self.id, res)
 
-        await self._value_response.wait()
-        value = self._value_response.value
+class Table(Element):
+    def __init__(self, webi, element_type, attr, html_tag, html_input_type, data, columns=None, length=None, page_size=100, cache_size=64):
+        super().__init__(webi, element_type, attr, html_tag, html_input_type)
+        self.data = data
+        self.columns = columns
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self._data_length = length # only needed for callable data sources
+        self._version = uuid.uuid4().hex[:8] # changes whenever the data changes
+        self._pages = OrderedDict() # (version, page) -> rows, the least recently used ones are evicted first
 
-        self._value_response.clear()
-        self._value_response.value = None
+        if columns is not None:
+            self.attr["columns"] = json.dumps([str(column) for column in columns])
+        self.attr.update({"length": self.length, "page_size": page_size, "version": self._version})
 
-        return value
+    @property
+    def length(self):
+        return self._data_length if callable(self.data) else len(self.data)
+
+    def _render_page(self, page):
+        start = page * self.page_size
+        stop = min(start + self.page_size, self.length)
+        if start >= stop:
+            return []
+
+        rows = self.data(start, stop) if callable(self.data) else self.data[start:stop]
+        if isinstance(rows, np.ndarray):
+            rows = rows.tolist()
+        return [_table_row(row, self.columns) for row in rows]
+
+    async def _send_rows(self, page):
+        key = (self._version, page)
+        rows = self._pages.get(key)
+        if rows is None:
+            rows = await asyncio.to_thread(self._render_page, page)
+            self._pages[key] = rows
+            if len(self._pages) > self.cache_size:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(key)
+
+        await self.webi.server._emit(self.webi.name, "table_rows", self.id, key[0], page, rows)
+
+    @Element._async()
+    async def refresh(self, data=None, length=None):
+        # Has to be called whenever the data changed, the browser then reloads the rows it shows
+        if data is not None:
+            self.data = data
+        if length is not None:
+            self._data_length = length
+        self._version = uuid.uuid4().hex[:8]
+        self._pages.clear()
+        await self.update_attr({"length": self.length, "version": self._version}, _async=True)
+
+class Chart(Element):
+    def __init__(self, webi, element_type, attr, html_tag, html_input_type, kind="line", capacity=10000):
+        super().__init__(webi, element_type, attr, html_tag, html_input_type)
+        self.kind = kind
+        self.capacity = capacity
+        self._buffer = np.zeros((capacity, 2), dtype="<f8") # ring buffer of (x, y) points
+        self._start = 0
+        self._count = 0
+        self._next_x = 0 # x of the next point without one
+        self.attr.update({"kind": kind, "capacity": capacity})
+
+    @property
+    def data(self):
+        # The points from the oldest to the newest
+        end = self._start + self._count
+        if end <= self.capacity:
+            return self._buffer[self._start:end].copy()
+        return np.concatenate([self._buffer[self._start:], self._buffer[:end - self.capacity]])
+
+    @Element._async()
+    async def append(self, values):
+        values = np.asarray(values, dtype="<f8")
+        if values.ndim <= 1:
+            # Values without x are numbered consecutively
+            y = values.reshape(-1)
+            points = np.empty((len(y), 2), dtype="<f8")
+            points[:, 0] = np.arange(self._next_x, self._next_x + len(y))
+            points[:, 1] = y
+            self._next_x += len(y)
+        elif values.ndim == 2 and values.shape[1] == 2:
+            points = values
+        else:
+            raise ValueError(f"Expected values or (x, y) points, got an array of shape {values.shape}")
+
+        points = points[-self.capacity:]
+        n = len(points)
+        if n == 0:
+            return
+
+        # Overwrite the oldest points once the buffer is full
+        end = (self._start + self._count) % self.capacity
+        first = min(n, self.capacity - end)
+        self._buffer[end:end + first] = points[:first]
+        self._buffer[:n - first] = points[first:]
+        overflow = max(self._count + n - self.capacity, 0)
+        self._start = (self._start + overflow) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+        # x is sent relative to the first point, so that large x (e.g. timestamps) keep their precision as 32-bit floats
+        offset = float(points[0, 0])
+        relative = points.astype("<f4")
+        relative[:, 0] = points[:, 0] - offset
+        await self.webi.server._emit(self.webi.name, "chart_append", self.id, relative.tobytes(), self.capacity, offset)
+
+    @Element._async()
+    async def clear(self):
+        self._start = 0
+        self._count = 0
+        self._next_x = 0
+        await self.webi.server._emit(self.webi.name, "chart_clear", self.id)
+
+class Canvas(Element):
+    # Opcodes of the recorded commands, see canvas.js
+    STYLE, RECT, LINE, PATH, TEXT, IMAGE = range(6)
+
+    def __init__(self, webi, element_type, attr, html_tag, html_input_type):
+        super().__init__(webi, element_type, attr, html_tag, html_input_type)
+        self._layers = set() # layers that have been drawn on
+        self._pending = {} # layer -> [cleared, recorded commands]
+        self._styles = {} # layer -> last (rgba, line_width) recorded
+        self._flush_task = None
+
+    def _record(self, layer, command, color=None, line_width=1):
+        self._layers.add(layer)
+        pending = self._pending.setdefault(layer, [False, bytearray()])
+
+        # The style only has to be sent when it changes
+        if color is not None:
+            style = (ImageColor.getcolor(color, "RGBA"), float(line_width))
+            if self._styles.get(layer) != style:
+                self._styles[layer] = style
+                pending[1] += struct.pack("<B4Bf", self.STYLE, *style[0], style[1])
+        pending[1] += command
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Everything recorded during the same event loop tick is sent as one message
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # sent by the next flush()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush(_async=True))
+
+    def rect(self, x, y, width, height, *, color="black", fill=True, line_width=1, layer=0):
+        self._record(layer, struct.pack("<B4fB", self.RECT, x, y, width, height, fill), color, line_width)
+
+    def line(self, x0, y0, x1, y1, *, color="black", line_width=1, layer=0):
+        self._record(layer, struct.pack("<B4f", self.LINE, x0, y0, x1, y1), color, line_width)
+
+    def path(self, points, *, color="black", line_width=1, closed=False, fill=False, layer=0):
+        points = np.asarray(points, dtype="<f4").reshape(-1, 2)
+        header = struct.pack("<BBI", self.PATH, closed | fill << 1, len(points))
+        self._record(layer, header + points.tobytes(), color, line_width)
+
+    def text(self, x, y, text, *, color="black", size=16, font="sans-serif", layer=0):
+        font = f"{size}px {font}".encode()
+        text = str(text).encode()
+        command = struct.pack("<B2fH", self.TEXT, x, y, len(font)) + font + struct.pack("<I", len(text)) + text
+        self._record(layer, command, color)
+
+    @Element._async()
+    async def image_tile(self, x, y, src, *, format="PNG", encoding=None, layer=0):
+        # Encoded off the event loop, like the sources of images
+        server = self.webi.server
+        buffer = await server.run_in_executor(server.encoding_executor, media.encode_image, src, format, encoding or {})
+        data = buffer.getvalue()
+        mimetype = media.mimetype("image", format).encode()
+        command = struct.pack("<B2fH", self.IMAGE, x, y, len(mimetype)) + mimetype + struct.pack("<I", len(data)) + data
+        self._record(layer, command)
+
+    def clear(self, layer=None):
+        # Clears one layer or all of them, the other layers don't have to be drawn again
+        for layer in (self._layers if layer is None else [layer]):
+            self._pending[layer] = [True, bytearray()]
+            self._styles.pop(layer, None)
+        if self._pending:
+            self._schedule_flush()
+
+    @Element._async()
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        self._styles = {} # every message sets its own style, so old ones can be dropped after a reconnect
+        if pending:
+            layers = [[layer, cleared, bytes(commands)] for layer, (cleared, commands) in sorted(pending.items())]
+            await self.webi.server._emit(self.webi.name, "canvas_draw", self.id, layers)
+
+def _table_row(row, columns):
+    if isinstance(row, dict):
+        row = [row.get(column) for column in columns] if columns is not None else list(row.values())
+    elif isinstance(row, (str, bytes)) or not isinstance(row, Iterable):
+        row = [row]
+    return ["" if cell is None else str(cell) for cell in row]
 
 class Group(Sequence):
     def __init__(self, webi, sort):
         self.id = uuid.uuid4().hex
         self.webi = webi
         self.sort = sort
-        self._members = []
+        self._members = {} # ordered ids of the members
         self._group = None
+        self._cache = {} # flattened member lists
         self.type = "group"
     
     def _async(default=None):
@@ -298,39 +652,46 @@ class Group(Sequence):
     @property
     def members(self):
         return self.get_members()
+
+    def _view(self, resolve_groups):
+        # Member lists are cached until the arrangement of any group changes
+        cached = self._cache.get(resolve_groups)
+        if cached is not None and cached[0] == self.webi._tree_version:
+            return cached[1]
+
+        members = []
+        for m_id in self._members:
+            if m_id in self.webi.elements: # Element
+                members.append(self.webi.elements[m_id])
+            else: # Group
+                group = self.webi.groups[m_id]
+                if resolve_groups:
+                    members.extend(group._view(resolve_groups))
+                else:
+                    members.append(group)
+
+        self._cache[resolve_groups] = (self.webi._tree_version, members)
+        return members
     
     def get_members(self, _except=[], resolve_groups=False):
-        def _get_members(ids, resolve_groups):
-            members = []
-            for m_id in ids:
-                if m_id in self.webi.elements: # Element
-                    members.append(self.webi.elements[m_id])
-                else: # Group
-                    group = self.webi.groups[m_id]
-                    if resolve_groups:
-                        members.extend(_get_members(group._members, resolve_groups))
-                    else:
-                        members.append(group)
-            
-            return members
-        
-        members = _get_members(self._members, resolve_groups)
+        members = self._view(resolve_groups)
 
         # Filter members
-        for i, exc in enumerate(_except):
-            if not isinstance(exc, str):
-                _except[i] = exc.id
-        members = [
-            m for m in members if not (m.id in _except or m.type in _except)
+        excluded = {exc if isinstance(exc, str) else exc.id for exc in _except}
+        return [
+            m for m in members if not (m.id in excluded or m.type in excluded)
         ]
-
-        return members
     
     def __getitem__(self, index):
-        return self.members[index]
+        return self._view(False)[index]
     
     def __len__(self):
         return len(self._members)
+
+    def __contains__(self, member):
+        # Elements, groups or their ids, anything else is not a member
+        id = getattr(member, "id", member)
+        return isinstance(id, str) and id in self._members
     
     @_async()
     async def _create(self):
@@ -347,22 +708,28 @@ class Group(Sequence):
     async def add_members(self, members):
         member_ids = []
         for member in members:
-            # Only add members that are not part of this group or the group itself
-            def check(member):
-                if member.id in self._members:
-                    raise ValueError(f"Element of type '{member.type}' with id '{member.id}' is already part of this group")
-                if member.id == self.id:
-                    raise ValueError("Attempt to add the group as a member of the group itself")
-                if member.type == "group":
-                    for mem in member.members:
-                        check(mem)
-            check(member)
+            # Only add members that are not part of this group
+            if member.id in self._members:
+                raise ValueError(f"Element of type '{member.type}' with id '{member.id}' is already part of this group")
+
+            # A group can't become a member of itself or of one of its members
+            if member.type == "group":
+                ancestor = self
+                while ancestor is not None:
+                    if ancestor.id == member.id:
+                        raise ValueError("Attempt to add the group as a member of the group itself")
+                    ancestor = ancestor.group
             
+            # Move the member out of its previous group
+            if member._group is not None:
+                del self.webi.groups[member._group]._members[member.id]
+
             # Set elements group and add to members
             member._group = self.id
-            self._members.append(member.id)
+            self._members[member.id] = None
             member_ids.append(member.id)
 
+        self.webi._tree_version += 1
         await self.webi.server._emit(self.webi.name, "add_to_group", self.id, member_ids)
     
     @_async()
@@ -375,11 +742,12 @@ class Group(Sequence):
                 
             # Set elements group to parent group and remove from members
             member._group = self._group
-            self._members.remove(member.id)
+            del self._members[member.id]
             if self._group is not None:
-                self.webi.groups[self._group]._members.append(member.id)
+                self.webi.groups[self._group]._members[member.id] = None
             member_ids.append(member.id)
 
+        self.webi._tree_version += 1
         await self.webi.server._emit(self.webi.name, "remove_from_group", self.id, member_ids)
     
     @_async()
@@ -388,15 +756,16 @@ class Group(Sequence):
         for member in self.members:
             member._group = self._group
             if self._group is not None:
-                self.webi.groups[self._group]._members.append(member.id)
+                self.webi.groups[self._group]._members[member.id] = None
 
         # Remove self from parent group (if possible)
         if self._group is not None:
-            self.webi.groups[self._group]._members.remove(self.id)
+            del self.webi.groups[self._group]._members[self.id]
             self._group = None
         
         del self.webi.groups[self.id]
-        self._members = []
+        self._members = {}
+        self.webi._tree_version += 1
         await self.webi.server._emit(self.webi.name, "disband_group", self.id)
     
     @_async()
@@ -408,27 +777,105 @@ class Group(Sequence):
                 raise ValueError(f"Element of type '{element.type}' with id '{element.id}' is not part of this group")
             
             ids.append(element.id)
+        if not ids:
+            return
             
         # Order self._members accordingly
-        ordered_members = []
+        moved = set(ids)
+        ordered_members = {}
         for m in self._members:
-            if m not in ids:
-                ordered_members.append(m)
             if m == ids[0]:
-                ordered_members.extend(ids)
+                ordered_members.update(dict.fromkeys(ids))
+            elif m not in moved:
+                ordered_members[m] = None
         self._members = ordered_members
+        self.webi._tree_version += 1
             
         await self.webi.server._emit(self.webi.name, "order", ids)
 
+    @_async()
+    async def reorder(self, members_in_order):
+        ids = [member.id for member in members_in_order]
+        if len(ids) != len(self._members) or set(ids) != self._members.keys():
+            raise ValueError("All members of the group have to be given exactly once")
+
+        # Members that are already in the right order stay, all others are moved behind their predecessor
+        positions = {m_id: i for i, m_id in enumerate(self._members)}
+        stable = _increasing_subsequence([positions[m_id] for m_id in ids])
+        moves = [
+            [m_id, ids[i - 1] if i > 0 else None]
+            for i, m_id in enumerate(ids) if i not in stable
+        ]
+
+        self._members = dict.fromkeys(ids)
+        self.webi._tree_version += 1
+        if moves:
+            await self.webi.server._emit(self.webi.name, "reorder", self.id, moves)
+
+# Style rules only send the properties that changed, None removes a property
+def _style_changes(styles, rule, style):
+    current = styles.setdefault(rule, {})
+    changes = {name: value for name, value in style.items() if current.get(name) != value}
+    for name, value in changes.items():
+        if value is None:
+            current.pop(name)
+        else:
+            current[name] = value
+    if not current:
+        styles.pop(rule)
+    return changes
+
+def _style_removals(styles, rule, style_names):
+    current = styles.get(rule, {})
+    changes = {name: None for name in style_names if current.pop(name, None) is not None}
+    if not current:
+        styles.pop(rule, None)
+    return changes
+
+def _check_class_name(name):
+    if not re.fullmatch(r"-?[_a-zA-Z][_a-zA-Z0-9-]*", name):
+        raise ValueError(f"'{name}' is not a valid class name")
+
+def _increasing_subsequence(values):
+    # Indices of a longest increasing subsequence, in O(n log n)
+    tails, tail_indices = [], []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        j = bisect.bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[j] = value
+            tail_indices[j] = i
+        previous[i] = tail_indices[j - 1] if j > 0 else None
+
+    indices = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.add(i)
+        i = previous[i]
+    return indices
+
 class WebI:
-    def __init__(self, port=8000):
+    def __init__(self, port=8000, batching=False, encoding_executor="thread", max_workers=None, inline_threshold=64 * 1024, cache_size=256 * 1024 * 1024, spool_size=1024 * 1024, handler_limit=16, update_rate=None, queue_size=1000):
         self.handlers = {}
         self.elements = {}
         self.groups = {}
         self.namespaces = {}
         self.port = port
         self.name = "/"
-        self.server = Server(port=self.port, event_handler=self._event, onload=lambda: self._onload(), webi=self)
+        self._requests = {}
+        self._tree_version = 0 # changes whenever groups are rearranged
+        self.style_classes = {} # class name -> {rule: style}
+        self.handler_limit = handler_limit
+        self.update_rate = update_rate
+        self._handler_semaphore = None
+        self._handler_tasks = {} # last dispatched handler task of each element
+        self.server = Server(port=self.port, event_handler=self._event, onload=lambda: self._onload(), webi=self,
+            batching=batching, encoding_executor=encoding_executor, max_workers=max_workers,
+            inline_threshold=inline_threshold, cache_size=cache_size, spool_size=spool_size, queue_size=queue_size
+        )
     
     def _async(default=None):
         def decorator(f):
@@ -448,7 +895,12 @@ class WebI:
         return decorator
 
     @_async()
-    async def input(self, type, **attr):
+    async def input(self, type, mirror=False, upload=None, decode=False, **attr):
+        if mirror and type not in Element.MIRROR_TYPES:
+            raise ValueError(f"Inputs of type '{type}' can not be mirrored")
+        if (upload or decode) and type != "file":
+            raise ValueError("Upload options are only supported by inputs of type 'file'")
+
         core = (DrawingBoard if type == "draw" else Element)(
                 webi = self,
                 element_type = f"input-{type}",
@@ -458,11 +910,23 @@ class WebI:
         )
 
         await core._create(_async=True)
+        if mirror:
+            await self.server._emit(self.name, "mirror_value", core.id)
+        if upload:
+            # Images are resized and re-encoded by the browser before they are uploaded
+            options = {
+                "max_width": upload.get("max_width"),
+                "max_height": upload.get("max_height"),
+                "type": media.mimetype("image", upload["format"]) if upload.get("format") else None,
+                "quality": upload["quality"] / 100 if upload.get("quality") is not None else None
+            }
+            await self.server._emit(self.name, "upload_options", core.id, options)
+        core._decode = decode
         
         return core
     
     @_async()
-    async def image(self, src, format="PNG", **attr):
+    async def image(self, src, format="PNG", encoding=None, **attr):
         core = MediaElement(
             webi = self,
             element_type = "image",
@@ -470,7 +934,8 @@ class WebI:
             html_tag = "img",
             html_input_type = None,
             src = src,
-            format = format 
+            format = format,
+            encoding = encoding
         )
 
         await core._create(_async=True)
@@ -550,6 +1015,63 @@ class WebI:
         
         return core
     
+    @_async()
+    async def table(self, data, columns=None, length=None, page_size=100, cache_size=64, **attr):
+        if callable(data) and length is None:
+            raise ValueError("Tables with a callable data source need a length")
+
+        core = Table(
+            webi = self,
+            element_type = "table",
+            attr = attr,
+            html_tag = "data-table",
+            html_input_type = None,
+            data = data,
+            columns = columns,
+            length = length,
+            page_size = page_size,
+            cache_size = cache_size
+        )
+
+        await core._create(_async=True)
+
+        return core
+
+    @_async()
+    async def canvas(self, width=400, height=300, **attr):
+        core = Canvas(
+            webi = self,
+            element_type = "canvas",
+            attr = attr,
+            html_tag = "command-canvas",
+            html_input_type = None
+        )
+
+        core.attr.update({"width": width, "height": height})
+
+        await core._create(_async=True)
+
+        return core
+
+    @_async()
+    async def chart(self, kind="line", capacity=10000, **attr):
+        if kind not in ("line", "scatter"):
+            raise ValueError(f"'{kind}' is not a supported chart kind")
+
+        core = Chart(
+            webi = self,
+            element_type = "chart",
+            attr = attr,
+            html_tag = "live-chart",
+            html_input_type = None,
+            kind = kind,
+            capacity = capacity
+        )
+
+        await core._create(_async=True)
+
+        return core
+
     def namespace(self, name):
         if (self.name + name) in ["/file_upload", "/get_file"]:
             raise ValueError(f"The namespace '{name}' is reserved")
@@ -583,16 +1105,80 @@ class WebI:
     
     @_async()
     async def download(self, buffer, filename):
-        file = {"src": buffer, "mimetype":"application/octet-stream"}
-        file_id = uuid.uuid4().hex
-        self.server.file_storage[file_id] = file
+        file_id = await self.server.store(buffer, "application/octet-stream")
         await self.server._emit(self.name, 
-            "download", str(file_id), filename
+            "download", file_id, filename
         )
     
     @_async()
     async def open_url(self, url, open_new_tab=False):
         await self.server._emit(self.name, "open_url", url, open_new_tab)
+
+    @_async()
+    async def update_class_style(self, name, style, *, rule="<class>"):
+        _check_class_name(name)
+        changes = _style_changes(self.style_classes.setdefault(name, {}), rule, style)
+        if not self.style_classes[name]:
+            del self.style_classes[name]
+        if changes:
+            await self.server._emit(self.name, "update_class_style", name, changes, rule)
+
+    @_async()
+    async def remove_class_style(self, name, style_names, *, rule="<class>"):
+        changes = _style_removals(self.style_classes.get(name, {}), rule, style_names)
+        if not self.style_classes.get(name):
+            self.style_classes.pop(name, None)
+        if changes:
+            await self.server._emit(self.name, "update_class_style", name, changes, rule)
+
+    def batch(self):
+        return self.server.namespaces[self.name].batch()
+
+    @property
+    def queue_stats(self):
+        return self.server.namespaces[self.name].queue_stats
+
+    @_async()
+    async def get_many(self, elements):
+        elements = list(elements)
+        if not self.server.namespaces[self.name].connected:
+            return [None] * len(elements)
+
+        # Files and drawings have to be uploaded, all other values are read at once
+        uploads = [el for el in elements if el.type in ("input-file", "input-draw")]
+        ids = [el.id for el in elements if el.type not in ("input-file", "input-draw")]
+
+        requests = [el.get(_async=True) for el in uploads]
+        if ids:
+            requests.append(self._request("get_values", ids))
+        results = await asyncio.gather(*requests)
+
+        values = dict(zip([el.id for el in uploads], results))
+        if ids:
+            values.update(zip(ids, results[-1]))
+        return [values[el.id] for el in elements]
+
+    async def _request(self, event, *data):
+        # The client answers with the same request id
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        try:
+            await self.server._emit(self.name, event, *data, request_id)
+            # The client has to answer right away, even inside of a batch
+            await self.server.namespaces[self.name].flush()
+            if not self.server.namespaces[self.name].connected:
+                # The request has only been queued, nobody is there to answer it
+                return None
+            return await future
+        finally:
+            self._requests.pop(request_id, None)
+
+    def _abort_requests(self):
+        # Pending requests can't be answered after the client disconnected
+        for future in self._requests.values():
+            if not future.done():
+                future.set_result(None)
     
     async def _onload(self):
         return
@@ -601,18 +1187,66 @@ class WebI:
         self._onload = handler
     
     # generic event handler
-    async def _event(self, type, id, value):
+    async def _event(self, type, id, value, request_id=None, has_value=False):
         if type == "value_response": # user called element.get()
-            # set elements value
-            self.elements[id]._value_response.value = value
-            self.elements[id]._value_response.set()
+            future = self._requests.get(request_id)
+            if future is not None and not future.done():
+                future.set_result(value)
+            return
+
+        if type == "value_update": # value of a mirrored element changed
+            if id in self.elements:
+                self.elements[id]._mirror_value = value
+                self.elements[id]._mirrored = True
+            return
+
+        if type == "row_request": # a table scrolled to rows it doesn't have yet
+            table = self.elements.get(id)
+            if isinstance(table, Table):
+                self._dispatch(id, lambda: table._send_rows(int(value)))
             return
 
         # call type specific handler(s) of element
-        if value is None:
-            value = await self.elements[id].get(_async=True)
-        for handler in self.handlers[type][id].values():
-            await handler(self.elements[id], value)
+        handlers = self.handlers.get(type, {}).get(id, {})
+        if not handlers:
+            return
+
+        async def run():
+            nonlocal value
+            if value is None and not has_value:
+                value = await self.elements[id].get(_async=True)
+            for handler in list(handlers.values()):
+                await handler(self.elements[id], value)
+
+        # Server side events (e.g. the progress of an upload) must not wait for the element's other handlers
+        self._dispatch(id, run, key=(id, type) if type in Element.SERVER_EVENTS else id)
+
+    def _dispatch(self, id, run, key=None):
+        # Handlers of one element run in order, handlers of different elements concurrently
+        if self._handler_semaphore is None:
+            self._handler_semaphore = asyncio.Semaphore(self.handler_limit)
+        key = id if key is None else key
+        previous = self._handler_tasks.get(key)
+
+        async def task():
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self._handler_semaphore:
+                await run()
+
+        def done(t):
+            if self._handler_tasks.get(key) is t:
+                del self._handler_tasks[key]
+            if not t.cancelled() and t.exception() is not None:
+                t.get_loop().call_exception_handler({
+                    "message": f"Exception in event handler of element {id}",
+                    "exception": t.exception(),
+                    "task": t
+                })
+
+        t = asyncio.get_running_loop().create_task(task())
+        self._handler_tasks[key] = t
+        t.add_done_callback(done)
     
     def show(self):
         self.server.run()
@@ -629,6 +1263,13 @@ class Namespace(WebI):
         self.namespaces = {}
         self.port = base.port
         self.name = base.name + name + "/"
+        self._requests = {}
+        self._tree_version = 0
+        self.style_classes = {}
+        self.handler_limit = base.handler_limit
+        self.update_rate = base.update_rate
+        self._handler_semaphore = None
+        self._handler_tasks = {}
         self.server = base.server
 
         self.show = None
@@ -1,128 +1,139 @@
-from airium import Airium
+from html import escape
+from functools import lru_cache
 
-class HTMLBuilder:
-    def _simple_input(id, **attr):
-        a = Airium()
+@lru_cache(maxsize=None)
+def _name(name):
+    # Python keywords can be passed with a trailing underscore (e.g. for_, class_)
+    return escape(name[:-1] if name.endswith("_") else name)
 
-        with a.div(id=id+"-container"):
-            label = attr.pop("label", None)
-            if label is not None: a.label(for_=id, _t=label, id=id+"-label")
+def _value(value):
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value is None:
+        return "null"
+    return escape(str(value))
 
-            a.input(id=id, **attr)
-
-        return str(a)
-    
-    def _button(id, **attr):
-        a = Airium()
+def _text(text):
+    return escape(str(text), quote=False)
 
-        with a.div(id=id+"-container"):
-            if "label" in attr:
-                attr["value"] = attr["label"]
-                del attr["label"]
+def _attributes(attr):
+    return "".join([f' {_name(name)}="{_value(value)}"' for name, value in attr.items()])
 
-            a.input(id=id, **attr)
+# Static parts of every element, the dynamic ones are escaped when they are inserted
+_CONTAINER = '<div id="{id}-container">\n{inner}\n</div>'
+_LABEL = '  <label for="{id}" id="{id}-label">{label}</label>\n'
 
-        return str(a)
-    
-    def _select(id, **attr):
-        del attr["type"]
+class HTMLBuilder:
+    def _label(id, attr):
+        label = attr.pop("label", None)
+        return "" if label is None else _LABEL.format(id=id, label=_text(label))
 
-        a = Airium()
-        with a.div(id=id+"-container"):
-            options = attr.pop("options")
-            selected = attr.pop("selected", [])
-            label = attr.pop("label", None)
+    def _simple_input(id, **attr):
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(id=id, inner=f'{label}  <input id="{id}"{_attributes(attr)} />')
 
-            if label is not None: a.label(for_=id, _t=label, id=id+"-label")
+    def _button(id, **attr):
+        if "label" in attr:
+            attr["value"] = attr.pop("label")
+        return _CONTAINER.format(id=id, inner=f'  <input id="{id}"{_attributes(attr)} />')
 
-            with a.select(id=id, **attr):
-                for i, option in enumerate(options):
-                    option_attr = {"value": option[1], "_t": option[0]}
-                    if i in selected:
-                        option_attr["selected"] = True
-                    a.option(**option_attr, id=id+"-option-"+option[0])
+    def _select(id, **attr):
+        del attr["type"]
+        options = attr.pop("options")
+        selected = attr.pop("selected", [])
+        label = HTMLBuilder._label(id, attr)
+
+        option_html = "".join([
+            f'\n    <option value="{_value(value)}"{" selected" if i in selected else ""}'
+            f' id="{id}-option-{_value(name)}">{_text(name)}</option>'
+            for i, (name, value) in enumerate(options)
+        ])
+        return _CONTAINER.format(
+            id=id, inner=f'{label}  <select id="{id}"{_attributes(attr)}>{option_html}\n  </select>'
+        )
 
-        return str(a)
-    
     def _textarea(id, **attr):
         del attr["type"]
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(id=id, inner=f'{label}  <textarea id="{id}"{_attributes(attr)}></textarea>')
 
-        a = Airium()
-        with a.div(id=id+"-container"):
-            label = attr.pop("label", None)
-            if label is not None: a.label(for_=id, _t=label, id=id+"-label")
-
-            a.textarea(id=id, **attr)
-
-        return str(a)
-    
     def _drawing_board(id, **attr):
         del attr["type"]
-
-        a = Airium()
-        with a.div(id=id+"-container"):
-            label = attr.pop("label", None)
-            if label is not None: a.label(for_=id, _t=label, id=id+"-label")
-
-            getattr(a, "drawing-board")(id=id, **attr)
-        
-        return str(a)
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(
+            id=id, inner=f'{label}  <drawing-board id="{id}"{_attributes(attr)}></drawing-board>'
+        )
+
+    def _data_table(id, **attr):
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(
+            id=id, inner=f'{label}  <data-table id="{id}"{_attributes(attr)}></data-table>'
+        )
+
+    def _live_chart(id, **attr):
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(
+            id=id, inner=f'{label}  <live-chart id="{id}"{_attributes(attr)}></live-chart>'
+        )
+
+    def _command_canvas(id, **attr):
+        label = HTMLBuilder._label(id, attr)
+        return _CONTAINER.format(
+            id=id, inner=f'{label}  <command-canvas id="{id}"{_attributes(attr)}></command-canvas>'
+        )
 
     def _img(id, **attr):
-            a = Airium()
-            with a.div(id=id+"-container"):
-                a.img(id=id, **attr)
-            return str(a)
-            
+        return _CONTAINER.format(id=id, inner=f'  <img id="{id}"{_attributes(attr)} />')
+
     def _audio(id, **attr):
-            a = Airium()
-            with a.div(id=id+"-container"):
-                a.audio(id=id, **attr)
-            return str(a)
+        return _CONTAINER.format(id=id, inner=f'  <audio id="{id}"{_attributes(attr)}></audio>')
 
     def _video(id, **attr):
-            a = Airium()
-            with a.div(id=id+"-container"):
-                a.video(id=id, **attr)
-            return str(a)
+        return _CONTAINER.format(id=id, inner=f'  <video id="{id}"{_attributes(attr)}></video>')
 
     def _p(id, **attr):
-            a = Airium()
-            text = attr.pop("text", "")
+        text = attr.pop("text", "")
+        return _CONTAINER.format(id=id, inner=f'  <p id="{id}">{_text(text)}</p>')
 
-            with a.div(id=id+"-container"):
-                a.p(id=id, _t=text)
-            return str(a)
-            
     def _h(id, **attr):
-            a = Airium()
-            text = attr.pop("text", "")
-            size = attr.pop("size", 1)
+        text = attr.pop("text", "")
+        size = int(attr.pop("size", 1))
+        return _CONTAINER.format(id=id, inner=f'  <h{size} id="{id}">{_text(text)}</h{size}>')
+
+    _inputs = {
+        "number": _simple_input, "text": _simple_input, "color": _simple_input,
+        "file": _simple_input, "checkbox": _simple_input, "range": _simple_input,
+        "button": _button, "select": _select, "textarea": _textarea
+    }
+    _tags = {
+        "drawing_board": _drawing_board, "data_table": _data_table, "live_chart": _live_chart,
+        "command_canvas": _command_canvas, "img": _img, "audio": _audio,
+        "video": _video, "p": _p, "h": _h
+    }
+
+    @classmethod
+    def builder(this, tag_name, type=None):
+        tag_name = tag_name.replace("-", "_")
 
-            with a.div(id=id+"-container"):
-                getattr(a, f"h{size}")(id=id, _t=text)
-            return str(a)
+        if tag_name == "input":
+            builder = this._inputs.get(type)
+            if builder is None:
+                raise ValueError(f"\'{type}\' is not a supported input type")
+        else:
+            builder = this._tags.get(tag_name)
+            if builder is None:
+                raise NotImplementedError(f"tag_name = '{tag_name}'")
+        return builder
 
     @classmethod
     def create_html_element(this, tag_name, id, **attr):
         if attr.get("type", 0) is None: attr.pop("type")
         attr.pop("style", None)
-        tag_name = tag_name.replace("-", "_")
+        return this.builder(tag_name, attr.get("type"))(id, **attr)
 
-        if tag_name == "input":
-            if attr["type"] in ["number", "text", "color", "file", "checkbox", "range"]:
-                return this._simple_input(id, **attr)
-                    
-            elif attr["type"] in ["button", "select", "textarea"]:
-                return this.__getattribute__(this, f"_{attr['type']}")(id, **attr)
-                    
-            else:
-                raise ValueError(f"\'{attr['type']}\' is not a supported input type")
-            
-        else:
-            try:
-                return this.__getattribute__(
-                    this, f"_{tag_name}"
-                )(id, **attr)
-            except AttributeError:
-                raise NotImplementedError(f"tag_name = '{tag_name}'")
\ No newline at end of file
+    @classmethod
+    def create_html_elements(this, elements):
+        # Renders many elements at once, each given as (tag_name, id, attr)
+        return [this.create_html_element(tag_name, id, **attr) for tag_name, id, attr in elements]
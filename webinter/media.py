@@ -0,0 +1,149 @@
+from PIL import Image, ImageOps
+from io import BytesIO
+import numpy as np
+from scipy.io import wavfile
+import os
+import mmap
+import hashlib
+from collections import OrderedDict
+
+# Format aliases: name -> (PIL format, default options)
+IMAGE_FORMATS = {
+    "JPG": ("JPEG", {}),
+    "PREVIEW": ("JPEG", {"quality": 60, "subsampling": 2}), # fast and lossy
+    "WEBP": ("WEBP", {"method": 0}), # fastest WebP compression
+}
+
+MIMETYPE_FORMATS = {"jpg": "jpeg", "preview": "jpeg"}
+
+def mimetype(media_type, format):
+    format = format.lower()
+    return f"{media_type}/{MIMETYPE_FORMATS.get(format, format)}"
+
+def image_array(src):
+    # Only copy the array if the dtype or the memory layout doesn't fit
+    if src.dtype != np.uint8:
+        src = src.astype(np.uint8)
+    return np.ascontiguousarray(src)
+
+# Runs inside of an executor, so all arguments have to be picklable
+def encode_image(src, format, options):
+    pil_format, defaults = IMAGE_FORMATS.get(format.upper(), (format.upper(), {}))
+
+    if isinstance(src, np.ndarray):
+        src = Image.fromarray(image_array(src))
+
+    buffer = BytesIO()
+    src.save(buffer, format=pil_format, **{**defaults, **options})
+    buffer.seek(0)
+    return buffer
+
+def encode_audio(src):
+    buffer = BytesIO()
+    wavfile.write(buffer, None, src)
+    buffer.seek(0)
+    return buffer
+
+# Runs inside of an executor, like encode_image
+def decode_image(data):
+    # Camera images are often stored rotated, with their orientation in the EXIF data
+    return np.asarray(ImageOps.exif_transpose(Image.open(BytesIO(data))))
+
+def dirty_tiles(previous, current, tile_size):
+    changed = previous != current
+    if changed.ndim == 3:
+        changed = changed.any(axis=2)
+
+    # Pad to a multiple of the tile size and check every tile at once
+    h, w = changed.shape
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:h, :w] = changed
+    grid = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+    return [(int(x) * tile_size, int(y) * tile_size) for y, x in zip(*np.nonzero(grid))]
+
+def encode_tiles(src, tiles, tile_size, format, options):
+    return [
+        [x, y, encode_image(src[y:y + tile_size, x:x + tile_size], format, options).getvalue()]
+        for x, y in tiles
+    ]
+
+def size(src):
+    if isinstance(src, BytesIO):
+        return src.getbuffer().nbytes
+    if isinstance(src, (str, os.PathLike)):
+        return os.path.getsize(src)
+    if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+        return memoryview(src).nbytes
+    return None # unknown (e.g. an open file)
+
+def read(src):
+    if isinstance(src, BytesIO):
+        return src.getvalue()
+    if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+        return bytes(src)
+    if hasattr(src, "read"): # file object
+        src.seek(0)
+        return src.read()
+    with open(src, "rb") as f:
+        return f.read()
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def source_key(src, format, options):
+    # Identifies a source together with its encoding
+    key = hashlib.blake2b(digest_size=16)
+    if isinstance(src, Image.Image):
+        key.update(f"{src.mode}{src.size}".encode())
+        key.update(src.tobytes())
+    else:
+        key.update(f"{src.dtype}{src.shape}".encode())
+        key.update(np.ascontiguousarray(src).data)
+    key.update(f"{format.upper()}{sorted(options.items())}".encode())
+    return key.hexdigest()
+
+class MediaStore:
+    # Encoded files by content hash, the least recently used ones are evicted first
+    def __init__(self, max_size, max_keys=4096, pinned=set):
+        self.max_size = max_size
+        self.max_keys = max_keys
+        self.pinned = pinned # returns the content hashes that must not be evicted
+        self.size = 0
+        self.files = OrderedDict()
+        self.encoded = OrderedDict() # source key -> content hash
+
+    def add(self, digest, data, mimetype, key=None):
+        if digest not in self.files:
+            self.files[digest] = {"src": data, "mimetype": mimetype}
+            self.size += len(data)
+        self.files.move_to_end(digest)
+
+        if key is not None:
+            self.encoded[key] = digest
+            self.encoded.move_to_end(key)
+            if len(self.encoded) > self.max_keys:
+                self.encoded.popitem(last=False)
+
+        # Always keep the newest file and the pinned ones, even if they exceed the limit
+        if self.size > self.max_size:
+            pinned = self.pinned()
+            for old in list(self.files)[:-1]:
+                if self.size <= self.max_size:
+                    break
+                if old not in pinned:
+                    self.size -= len(self.files.pop(old)["src"])
+
+    def get(self, digest):
+        file = self.files.get(digest)
+        if file is not None:
+            self.files.move_to_end(digest)
+        return file
+
+    def lookup(self, key):
+        digest = self.encoded.get(key)
+        return digest if digest in self.files else None
+
+    def __contains__(self, digest):
+        return digest in self.files
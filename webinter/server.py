@@ -3,13 +3,29 @@ from quart import render_template
 from quart import request
 from quart import make_response
 from quart import send_file
+from quart import Request
+from quart import current_app
+from quart.wrappers.response import ResponseBody
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import socketio as pysocketio
+from . import media
+from .state import UIState
+from .html_builder import HTMLBuilder
 import asyncio
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
 import io
 import signal
+import tempfile
 import copy
+import contextlib
+import functools
+import threading
+import os
+import json
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 class Namespace:
     def __init__(self, server, namespace, webi, event_handler, onload):
@@ -19,8 +35,9 @@ class Namespace:
         self.event_handler = event_handler
         self.onload = onload
 
-        self.onstart = []
-        self.onrestart = []
+        self.entry_state = UIState(server.queue_size) # the page as it was when the first client connected
+        self.pending_state = None # the entry state with everything issued while no client was connected
+        self._queued = 0
         self.first_connection = True
         self.connected = False
 
@@ -28,12 +45,28 @@ class Namespace:
 
         self.sid = None
 
+        self._batch = []
+        self._batch_depth = 0
+        self._flush_task = None
+
+        self._updates = {} # pending rate limited updates by element id
+        self._last_update = {} # loop time of the last sent update by element id
+
         self.routes()
     
     def routes(self):
         @self.server.app.route(self.namespace, endpoint=self.namespace)
         async def endpoint():
-            return await render_template("app.html")
+            # Render the page as it will be once the client connects
+            page = (self.pending_state or self.entry_state).render()
+            initial_state = json.dumps({
+                "token": (self.pending_state or self.entry_state).token,
+                "operations": self._pack(page["operations"])
+            }).replace("<", "\\u003c")
+            return await render_template(
+                "app.html", content=page["content"], unplaced=page["unplaced"],
+                style=page["style"], initial_state=initial_state
+            )
         
         @self.server.socketio.on("connect", namespace=self.namespace)
         async def on_connect(id, env, auth):
@@ -45,13 +78,16 @@ class Namespace:
                     self.first_connection = False
                     self.set_entry_point()
                 else:
-                    for event in self.onrestart:
-                        await self.server.socketio.emit(*event, namespace=self.namespace)
                     self.restore_entry_point()
 
-                while len(self.onstart):
-                    event = self.onstart.pop(0)
-                    await self.server.socketio.emit(*event, namespace=self.namespace)
+                state = self.pending_state or self.entry_state
+                self.pending_state = None
+                if auth and auth.get("state") == state.token:
+                    # The page has been rendered from this state, only binary data is missing
+                    await self._send(state.render()["binary_operations"])
+                else:
+                    # Rebuild the page in one message, no matter how it was put together
+                    await self._send([("snapshot", (self._pack(state.operations()),))])
                 
                 await self.onload()
             else:
@@ -61,41 +97,70 @@ class Namespace:
         async def on_disconnect(id):
             if id == self.sid:
                 self.connected = False
+                self.webi._abort_requests()
         
         @self.server.socketio.on("element_event", namespace=self.namespace)
-        async def on_element_event(id, type, element_id, value):
-            await self.event_handler(type, element_id, value)
+        async def on_element_event(id, type, element_id, value, request_id=None):
+            await self.event_handler(type, element_id, value, request_id)
+
+        # Coalesced events of throttled or debounced handlers, which carry their values
+        @self.server.socketio.on("element_events", namespace=self.namespace)
+        async def on_element_events(id, type, element_id, values):
+            for value in values:
+                await self.event_handler(type, element_id, value, has_value=True)
         
         @self.server.socketio.on("error", namespace=self.namespace)
         async def on_error(id, msg):
             raise Exception(f"[ERROR]: {msg} ({self.namespace})")
     
+    @staticmethod
+    def _copy_handlers(handlers):
+        return {event: {id: dict(h) for id, h in ids.items()} for event, ids in handlers.items()}
+
+    @staticmethod
+    def _copy_state(state):
+        # Copy the containers that are changed in place, share everything else
+        state = copy.copy(state)
+        for key in ("attr", "_members", "_classes", "_buffer", "_layers", "_styles"):
+            if key in state:
+                state[key] = copy.copy(state[key])
+        if "_style" in state:
+            state["_style"] = {rule: dict(style) for rule, style in state["_style"].items()}
+        return state
+
+    @staticmethod
+    def _copy_style_classes(style_classes):
+        return {name: {rule: dict(style) for rule, style in rules.items()} for name, rules in style_classes.items()}
+
     def set_entry_point(self):
-        self.entry_point["handlers"] = copy.deepcopy(self.webi.handlers)
+        self.entry_point["handlers"] = self._copy_handlers(self.webi.handlers)
+        self.entry_point["style_classes"] = self._copy_style_classes(self.webi.style_classes)
 
         self.entry_point["elements"] = {}
         for el_id, el in self.webi.elements.items():
-            self.entry_point["elements"][el_id] = copy.copy(el.__dict__)
+            self.entry_point["elements"][el_id] = self._copy_state(el.__dict__)
             self.entry_point["elements"][el_id]["webi"] = self.webi
 
         self.entry_point["groups"] = {}
         for gp_id, gp in self.webi.groups.items():
-            self.entry_point["groups"][gp_id] = copy.copy(gp.__dict__)
+            self.entry_point["groups"][gp_id] = self._copy_state(gp.__dict__)
             self.entry_point["groups"][gp_id]["webi"] = self.webi
     
     def restore_entry_point(self):
-        self.webi.handlers = copy.deepcopy(self.entry_point["handlers"])
+        self.webi.handlers = self._copy_handlers(self.entry_point["handlers"])
+        self.webi.style_classes = self._copy_style_classes(self.entry_point["style_classes"])
+        self.webi._tree_version += 1 # cached member lists are outdated
 
         for element_id in copy.copy(self.webi.elements):
             if element_id in self.entry_point["elements"]:
-                self.webi.elements[element_id].__dict__.update(self.entry_point["elements"][element_id])
+                self.webi.elements[element_id].__dict__.update(self._copy_state(self.entry_point["elements"][element_id]))
             else:
                 self.webi.elements[element_id].webi = None
                 del self.webi.elements[element_id]
 
         for group_id in copy.copy(self.webi.groups):
             if group_id in self.entry_point["groups"]:
-                self.webi.groups[group_id].__dict__.update(self.entry_point["groups"][group_id])
+                self.webi.groups[group_id].__dict__.update(self._copy_state(self.entry_point["groups"][group_id]))
             else:
                 self.webi.groups[group_id].webi = None
                 del self.webi.groups[group_id]
@@ -103,75 +168,443 @@ class Namespace:
     async def emit(self, event, *data):
         if self.server.ended:
             raise Exception("The server has been shut down")
+        batched = self.connected and (self._batch_depth or self.server.batching)
+        if event == "create_element" and not batched:
+            event, data = self._render([(event, data)])[0]
+
         if not self.connected:
-            self.onstart.append((event, data))
-            if self.first_connection:
-                self.onrestart.append((event, data))
+            self._queue(event, data)
+            return
+
+        # Pending updates of an element have to arrive before anything else that concerns it
+        if self._updates and data and isinstance(data[0], str) and data[0] in self._updates:
+            await self.flush_updates(data[0])
+
+        if batched:
+            self._batch.append((event, data))
+            if not self._batch_depth and self._flush_task is None:
+                # Send everything issued during this tick as one frame
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
             return
         
         await self.server.socketio.emit(event, data, namespace=self.namespace)
 
+    async def emit_limited(self, rate, event, element_id, *data):
+        # Updates of an element are merged (latest value wins) and sent at most rate times per second
+        if not self.connected:
+            return await self.emit(event, element_id, *data)
+
+        pending = self._updates.get(element_id)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            delay = max(0, self._last_update.get(element_id, 0) + 1 / rate - loop.time())
+            pending = self._updates[element_id] = {
+                "attributes": {},
+                "removed": set(),
+                "style": {},
+                "handle": loop.call_later(delay, lambda: loop.create_task(self.flush_updates(element_id)))
+            }
+
+        if event == "update_attributes":
+            pending["attributes"].update(data[0])
+            pending["removed"].difference_update(data[0])
+        elif event == "remove_attributes":
+            for name in data[0]:
+                pending["attributes"].pop(name, None)
+            pending["removed"].update(data[0])
+        elif event == "update_style":
+            changes, rule = data
+            pending["style"].setdefault(rule, {}).update(changes)
+
+    async def flush_updates(self, element_id):
+        pending = self._updates.pop(element_id, None)
+        if pending is None:
+            return
+        pending["handle"].cancel()
+        self._last_update[element_id] = asyncio.get_running_loop().time()
+
+        if pending["attributes"]:
+            await self.emit("update_attributes", element_id, pending["attributes"])
+        if pending["removed"]:
+            await self.emit("remove_attributes", element_id, list(pending["removed"]))
+        for rule, style in pending["style"].items():
+            await self.emit("update_style", element_id, style, rule)
+
+    async def _flush_soon(self):
+        self._flush_task = None
+        await self.flush()
+
+    @staticmethod
+    def _render(operations):
+        # Elements are created as (tag_name, id, attr), those of a batch are rendered in one call
+        indices = [i for i, (event, data) in enumerate(operations) if event == "create_element" and isinstance(data[1], tuple)]
+        rendered = HTMLBuilder.create_html_elements([operations[i][1][1] for i in indices])
+        for i, html in zip(indices, rendered):
+            operations[i] = ("create_element", (operations[i][1][0], html))
+        return operations
+
+    async def flush(self):
+        operations, self._batch = self._render(self._batch), []
+        if not self.connected:
+            for event, data in operations:
+                self._queue(event, data)
+            return
+        await self._send(operations)
+
+    def _queue(self, event, data):
+        # Everything before the first connection is part of the page every client starts with
+        if self.first_connection:
+            state = self.entry_state
+        else:
+            if self.pending_state is None:
+                self.pending_state = self.entry_state.copy()
+            state = self.pending_state
+
+        # Superseded operations and those of removed elements are collapsed, so the state stays bounded
+        state.apply(event, data)
+        self._queued += 1
+
+    @property
+    def queue_stats(self):
+        state = self.pending_state or self.entry_state
+        return {"queued": self._queued, "pending": len(state.operations()), "dropped": state.dropped}
+
+    @staticmethod
+    def _pack(operations):
+        return [[event, list(data)] for event, data in operations]
+
+    async def _send(self, operations):
+        if len(operations) == 1:
+            await self.server.socketio.emit(*operations[0], namespace=self.namespace)
+        elif len(operations) > 1:
+            await self.server.socketio.emit(
+                "batch", (self._pack(operations),),
+                namespace=self.namespace
+            )
+
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                await self.flush()
+
+class UploadRequest(Request):
+    def make_form_data_parser(self):
+        # Keep small uploads in memory and spool large ones to disk
+        parser = super().make_form_data_parser()
+        spool_size = current_app.config["SPOOL_SIZE"]
+        parser.stream_factory = lambda *_: tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+        return parser
+
+async def read_chunks(file, chunk_size=1024 * 1024):
+    # Reads an uploaded file piece by piece without blocking the event loop
+    file.seek(0)
+    while True:
+        chunk = await asyncio.to_thread(file.read, chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+class MediaBody(ResponseBody):
+    # Serves (a range of) a buffer or a seekable file object
+    buffer_size = 64 * 1024
+
+    def __init__(self, src):
+        if isinstance(src, io.BytesIO):
+            src = src.getbuffer()
+
+        try:
+            self.src = memoryview(src).cast("B")
+            self.size = len(self.src)
+        except TypeError: # file object
+            self.src = src
+            self.lock = threading.Lock()
+            with self.lock:
+                self.size = src.seek(0, io.SEEK_END)
+
+        self.begin = 0
+        self.end = self.size
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        pass
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        position = self.begin
+        while position < self.end:
+            size = min(self.buffer_size, self.end - position)
+            if isinstance(self.src, memoryview):
+                chunk = bytes(self.src[position:position + size])
+            else:
+                chunk = await asyncio.to_thread(self._read, position, size)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+    def _read(self, position, size):
+        with self.lock:
+            self.src.seek(position)
+            return self.src.read(size)
+
+    async def make_conditional(self, begin, end):
+        if begin < 0: # suffix range, the last -begin bytes
+            begin = max(self.size + begin, 0)
+        self.begin = begin
+        self.end = self.size if end is None else min(self.size, end)
+        if self.begin >= self.end:
+            raise RequestedRangeNotSatisfiable()
+        return self.size
+
+def file_value(file, size, filename, mimetype):
+    return {
+        "file": file,
+        "size": size,
+        "name": filename,
+        "base": "".join(filename.split(".")[:-1]),
+        "extension": filename.split(".")[-1],
+        "type": mimetype.split("/")[0],
+        "format": mimetype.split("/")[-1]
+    }
+
 class Server:
-    def __init__(self, port, event_handler, onload, webi):
+    UPLOAD_TIMEOUT = 30 * 60 # unfinished uploads are discarded after this many seconds without a chunk
+
+    def __init__(self, port, event_handler, onload, webi, batching=False, encoding_executor="thread", max_workers=None, inline_threshold=64 * 1024, cache_size=256 * 1024 * 1024, spool_size=1024 * 1024, queue_size=1000):
         self.app = Quart(__name__)
+        self.app.request_class = UploadRequest
         self.socketio = pysocketio.AsyncServer(async_mode='asgi')
         self.socketio_app = pysocketio.ASGIApp(self.socketio, self.app)
 
         self.config = Config()
         self.config.bind = [f"127.0.0.1:{port}"]
         self.app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024 # 1GB
+        self.app.config['SPOOL_SIZE'] = spool_size
         self.shutdown_trigger = None
 
         self.started = False
         self.ended = False
+        self.batching = batching
 
-        self.file_storage = {}
+        self.encoding_executor = encoding_executor
+        self.max_workers = max_workers
+        self.executors = {}
+        self.inline_threshold = inline_threshold
+        self.queue_size = queue_size
+
+        self.file_storage = media.MediaStore(cache_size, pinned=self.referenced_files)
+        self.media_sources = {} # persistent, seekable sources of audio and video elements
+        self.uploads = {} # unfinished chunked uploads by upload id
+        self.upload_sweep = None
 
         self.namespaces = {webi.name: Namespace(self, webi.name, webi, event_handler, onload)}
 
         self.routes()
 
+    def referenced_files(self):
+        # Files that are sent again when a client (re)connects
+        digests = set()
+        for namespace in self.namespaces.values():
+            for state in (namespace.entry_state, namespace.pending_state):
+                if state is not None:
+                    digests |= state.files()
+        return digests
+
+    def schedule_upload_sweep(self):
+        if self.upload_sweep is None:
+            self.upload_sweep = asyncio.get_running_loop().call_later(self.UPLOAD_TIMEOUT, self.sweep_uploads)
+
+    def sweep_uploads(self):
+        self.upload_sweep = None
+        now = time.monotonic()
+        for upload_id, upload in list(self.uploads.items()):
+            if now - upload["active"] >= self.UPLOAD_TIMEOUT:
+                del self.uploads[upload_id]
+                with upload["lock"]:
+                    upload["file"].close()
+        if self.uploads:
+            self.schedule_upload_sweep()
+
     def routes(self):
         @self.app.route("/file_upload", methods=["POST"])
         async def file_upload():
             element_id = (await request.form).get("id")
             files = (await request.files).getlist(element_id)
             namespace = (await request.form).get("namespace")
+            request_id = (await request.form).get("request_id")
 
             value = []
             for f in files:
-                buffer = io.BytesIO()
-                f.stream.seek(0)
-                buffer.write(f.stream.read())
-                buffer.seek(0)
-                value.append({
-                    "file": buffer,
-                    "name": f.filename,
-                    "base": "".join(f.filename.split(".")[:-1]),
-                    "extension": f.filename.split(".")[-1],
-                    "type": f.mimetype.split("/")[0],
-                    "format": f.mimetype.split("/")[-1]
-                })
+                # Quart closes the files of a request, so take over the spooled file
+                file = f.stream
+                f.stream = io.BytesIO()
+                size = file.seek(0, io.SEEK_END)
+                file.seek(0)
+                value.append(file_value(file, size, f.filename, f.mimetype))
                 
-            await self.namespaces[namespace].event_handler("value_response", element_id, value)
+            await self.namespaces[namespace].event_handler("value_response", element_id, value, request_id)
 
             response = await make_response("OK")
             response.headers["Access-Control-Allow-Origin"] = "*"
             return response
 
+        @self.app.route("/upload/start", methods=["POST"])
+        async def upload_start():
+            info = await request.get_json()
+            if not isinstance(info.get("chunk_size"), int) or info["chunk_size"] <= 0 or not isinstance(info.get("size"), int) or info["size"] < 0:
+                return "Invalid upload", 400
+
+            # The same file of the same element gets the same id, so interrupted uploads can be resumed
+            key = f'{info["namespace"]}|{info["id"]}|{info["name"]}|{info["size"]}|{info["last_modified"]}'
+            upload_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+
+            upload = self.uploads.get(upload_id)
+            if upload is None or upload["chunk_size"] != info["chunk_size"]:
+                upload = self.uploads[upload_id] = {
+                    "file": tempfile.TemporaryFile(),
+                    "lock": threading.Lock(),
+                    "namespace": info["namespace"],
+                    "element_id": info["id"],
+                    "name": info["name"],
+                    "mimetype": info["type"] or "application/octet-stream",
+                    "size": info["size"],
+                    "chunk_size": info["chunk_size"],
+                    "received": set(),
+                    "loaded": 0
+                }
+            upload["active"] = time.monotonic()
+            self.schedule_upload_sweep()
+
+            return {"upload_id": upload_id, "received": sorted(upload["received"])}
+
+        @self.app.route("/upload/chunk", methods=["POST"])
+        async def upload_chunk():
+            upload = self.uploads.get(request.args.get("upload_id"))
+            if upload is None:
+                return "Unknown upload", 404
+
+            try:
+                index = int(request.args.get("index"))
+            except (TypeError, ValueError):
+                return "Invalid chunk index", 400
+            if not 0 <= index < -(-upload["size"] // upload["chunk_size"]):
+                return "Invalid chunk index", 400
+            upload["active"] = time.monotonic()
+            offset = index * upload["chunk_size"]
+            data = await request.get_data()
+
+            if len(data) != min(upload["chunk_size"], upload["size"] - offset):
+                return "Invalid chunk size", 422
+            checksum = request.headers.get("X-Chunk-Hash")
+            if checksum and await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest()) != checksum:
+                return "Checksum mismatch", 422
+
+            def write():
+                with upload["lock"]:
+                    upload["file"].seek(offset)
+                    upload["file"].write(data)
+            await asyncio.to_thread(write)
+
+            if index not in upload["received"]:
+                upload["received"].add(index)
+                upload["loaded"] += len(data)
+                await self.namespaces[upload["namespace"]].event_handler(
+                    "upload_progress", upload["element_id"],
+                    {"name": upload["name"], "loaded": upload["loaded"], "total": upload["size"]}
+                )
+
+            return "OK"
+
+        @self.app.route("/upload/finish", methods=["POST"])
+        async def upload_finish():
+            info = await request.get_json()
+
+            uploads = [self.uploads.get(upload_id) for upload_id in info["upload_ids"]]
+            for upload in uploads:
+                if upload is None or upload["loaded"] != upload["size"]:
+                    return "Incomplete upload", 409
+
+            value = []
+            for upload_id, upload in zip(info["upload_ids"], uploads):
+                del self.uploads[upload_id]
+                upload["file"].flush()
+                upload["file"].seek(0)
+                value.append(file_value(upload["file"], upload["size"], upload["name"], upload["mimetype"]))
+
+            await self.namespaces[info["namespace"]].event_handler("value_response", info["id"], value, info["request_id"])
+
+            return "OK"
+
         @self.app.route("/get_file", methods=["GET"])
         async def get_file():
-            element_id = request.args.get("id")
-            file = self.file_storage.pop(element_id, None)
+            digest = request.args.get("id")
+            file = self.file_storage.get(digest)
 
             if file is None:
-                return f"No file found for id = {element_id}", 400
-            
-            return await send_file(file["src"], mimetype = file["mimetype"])
+                return f"No file found for id = {digest}", 400
+
+            # Files are addressed by their content, so they never change
+            response = self.app.response_class(file["src"], mimetype=file["mimetype"])
+            response.set_etag(digest)
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 60 * 60
+            response.cache_control.immutable = True
+            return await response.make_conditional(request)
     
+        @self.app.route("/media/<element_id>", methods=["GET"])
+        async def get_media(element_id):
+            file = self.media_sources.get(element_id)
+
+            if file is None:
+                return f"No media found for id = {element_id}", 404
+
+            # Both support range requests, so playback can start right away
+            if isinstance(file["src"], (str, os.PathLike)):
+                response = await send_file(file["src"], mimetype=file["mimetype"], conditional=True)
+            else:
+                body = MediaBody(file["src"])
+                response = self.app.response_class(body, mimetype=file["mimetype"])
+                response.content_length = body.size
+                await response.make_conditional(request, accept_ranges=True, complete_length=body.size)
+            response.headers["Accept-Ranges"] = "bytes"
+            return response
+    
+    async def store(self, src, mimetype, key=None):
+        # Returns the id (content hash) under which the file can be fetched
+        data = src if isinstance(src, bytes) else await self.run_in_executor("thread", media.read, src)
+        digest = await self.run_in_executor("thread", media.content_digest, data)
+        self.file_storage.add(digest, data, mimetype, key)
+        return digest
+
     async def _emit(self, namespace, event, *data):
         await self.namespaces[namespace].emit(event, *data)
     
+    def executor(self, kind):
+        if not isinstance(kind, str): # custom executor
+            return kind
+
+        if kind not in self.executors:
+            if kind == "thread":
+                self.executors[kind] = ThreadPoolExecutor(self.max_workers)
+            elif kind == "process":
+                self.executors[kind] = ProcessPoolExecutor(self.max_workers)
+            else:
+                raise ValueError(f"'{kind}' is not a supported executor")
+        return self.executors[kind]
+
+    async def run_in_executor(self, kind, f, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(kind), functools.partial(f, *args))
+
     def add_namespace(self, webi, event_handler, onload):
         self.namespaces[webi.name] = Namespace(self, webi.name, webi, event_handler, onload)
 
@@ -198,4 +631,7 @@ class Server:
         self.started = True
         loop.run_until_complete(serve(self.socketio_app, self.config, shutdown_trigger=self.shutdown_trigger.wait))
         self.started = False
-        self.ended = True
\ No newline at end of file
+        self.ended = True
+
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,381 @@
+import copy
+import re
+import uuid
+from collections import deque
+import numpy as np
+
+ROOT = "" # id of the top level container
+MAX_LAYER_SIZE = 16 * 1024 * 1024 # bytes of drawing commands kept per canvas layer
+
+# Operations which only make sense for the client they were sent to
+IGNORED = {"get_value", "get_values", "get_drawing_board", "clear_drawing_board", "undo_drawing_board", "table_rows"}
+
+# Operations which create elements or concern the whole page, all others concern the element or group given first
+PAGE_OPERATIONS = {"create_element", "create_group", "update_class_style", "order", "alert", "download", "open_url"}
+
+def binary(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(binary(v) for v in value)
+    if isinstance(value, dict):
+        return any(binary(v) for v in value.values())
+    return False
+
+def css_property(name):
+    # backgroundColor -> background-color
+    return re.sub("([A-Z])", r"-\1", name).lower()
+
+def css_rule(selector, properties):
+    declarations = "".join(f"{css_property(name)}: {value};" for name, value in properties.items())
+    return f"{selector} {{{declarations}}}"
+
+def update_rule(rules, rule, changes):
+    # Changes only contain the properties that changed, None removes a property
+    style = rules.setdefault(rule, {})
+    for name, value in changes.items():
+        if value is None:
+            style.pop(name, None)
+        else:
+            style[name] = value
+    if not style:
+        del rules[rule]
+
+def merge_points(chunks):
+    # Chunks of float32 (x - offset, y) points -> one chunk relative to its first x
+    points = np.concatenate([np.frombuffer(data, "<f4").reshape(-1, 2).astype("<f8") + (offset, 0) for offset, data in chunks])
+    offset = float(points[0, 0])
+    points[:, 0] -= offset
+    return points.astype("<f4").tobytes(), offset
+
+class UIState:
+    # Compacted model of the page, built from the operations sent to the client
+    def __init__(self, max_transient=1000):
+        self.elements = {} # id -> state of the element
+        self.groups = {} # id -> {"sort": bool}
+        self.classes = {} # style class name -> {rule: style}
+        self.children = {ROOT: []} # container id -> ordered ids of its children
+        self.parent = {} # id -> id of its container, None if not placed anywhere
+        self.transient = deque(maxlen=max_transient) # operations without lasting state (alerts, downloads, ...)
+        self.dropped = 0 # transient operations that didn't fit, operations on unknown elements and old canvas drawings
+        self.id = uuid.uuid4().hex
+        self.version = 0
+
+    def copy(self):
+        state = copy.deepcopy(self)
+        state.id = uuid.uuid4().hex
+        return state
+
+    def apply(self, event, data):
+        self.version += 1
+        handler = getattr(self, f"_{event}", None)
+        if event in IGNORED:
+            pass
+        elif event not in PAGE_OPERATIONS and data and isinstance(data[0], str) and data[0] not in self.parent:
+            # The element has been removed or was created while a client was connected
+            self.dropped += 1
+        elif handler is not None:
+            handler(*data)
+        elif data and isinstance(data[0], str) and data[0] in self.elements:
+            # Other operations on an element only keep their latest arguments
+            self.elements[data[0]]["setup"][event] = data
+        else:
+            # Only the newest ones are kept
+            if len(self.transient) == self.transient.maxlen:
+                self.dropped += 1
+            self.transient.append((event, data))
+
+    @property
+    def token(self):
+        # Identifies this exact state, e.g. to recognize a page rendered from it
+        return f"{self.id}.{self.version}"
+
+    def files(self):
+        # Ids of the cached files that the page still refers to
+        return {
+            element["src"][1].removeprefix("/get_file?id=") for element in self.elements.values()
+            if element["src"] is not None and isinstance(element["src"][1], str) and element["src"][1].startswith("/get_file?id=")
+        }
+
+    def operations(self):
+        # Shortest list of operations that recreates the page
+        return self._structure() + self._styling() + self._details()
+
+    def _structure(self):
+        operations = [("create_group", (id, group["sort"])) for id, group in self.groups.items()]
+        operations.extend(("create_element", (id, element["html"])) for id, element in self.elements.items())
+
+        for id in self.groups:
+            if self.children[id]:
+                operations.append(("add_to_group", (id, list(self.children[id]))))
+        for id, element in self.elements.items():
+            if self.parent[id] == ROOT or (element["placed"] and self.parent[id] is not None):
+                operations.append(("add_element", (id, 0, "")))
+            if self.parent[id] == ROOT and not element["placed"]: # moved there without being added
+                operations.append(("mark_unplaced", (id,)))
+        if len(self.children[ROOT]) > 1:
+            operations.append(("order", (list(self.children[ROOT]),)))
+        return operations
+
+    def _styling(self):
+        operations = []
+        for name, rules in self.classes.items():
+            for rule, style in rules.items():
+                operations.append(("update_class_style", (name, style, rule)))
+        for id, element in self.elements.items():
+            for rule, style in element["style"].items():
+                operations.append(("update_style", (id, style, rule)))
+            operations.extend(("add_class", (id, name)) for name in element["classes"])
+            if element["hidden"]:
+                operations.append(("change_visibility", (id, "hide")))
+        return operations
+
+    def _details(self):
+        operations = []
+        for id, element in self.elements.items():
+            if element["attributes"]:
+                operations.append(("update_attributes", (id, element["attributes"])))
+            if element["removed"]:
+                operations.append(("remove_attributes", (id, list(element["removed"]))))
+            for event, options in element["events"].items():
+                operations.append(("register_event", (id, event, options)))
+            operations.extend(element["setup"].items())
+            if element["src"] is not None:
+                operations.append(("change_src", (id, *element["src"])))
+            operations.extend(("patch_src", (id, *patch)) for patch in element["patches"])
+            if element["canvas"]:
+                layers = [[layer, True, b"".join(commands["chunks"])] for layer, commands in sorted(element["canvas"].items())]
+                operations.append(("canvas_draw", (id, layers)))
+            if element["chart"] is not None:
+                data, offset = merge_points(element["chart"]["chunks"])
+                operations.append(("chart_append", (id, data, element["chart"]["capacity"], offset)))
+
+        operations.extend(self.transient)
+        return operations
+
+    def render(self):
+        # The page as html, the remaining operations are split into those that can be embedded as JSON and binary ones
+        def node(id):
+            if id in self.groups:
+                sort = ' sort=""' if self.groups[id]["sort"] else ""
+                members = "".join(node(member) for member in self.children[id])
+                return f'<div id="{id}" class="group"{sort}>{members}</div>'
+
+            element = self.elements[id]
+            classes = "element" if element["placed"] else "element unplaced"
+            hidden = ' style="display: none;"' if element["hidden"] else ""
+            html = element["html"].replace(
+                f'<div id="{id}-container">', f'<div id="{id}-container" class="{classes}"{hidden}>', 1
+            )
+            if element["classes"] and ' class="' not in element["html"] and "class" not in element["attributes"]:
+                html = html.replace(f' id="{id}"', f' id="{id}" class="{" ".join(element["classes"])}"', 1)
+            return html
+
+        style = []
+        for name, rules in self.classes.items():
+            for rule, properties in rules.items():
+                style.append(css_rule(rule.replace("<class>", f".{name}"), properties))
+        for id, element in self.elements.items():
+            for rule, properties in element["style"].items():
+                style.append(css_rule(rule.replace("<self>", f"[id='{id}']"), properties))
+
+        details = self._details()
+        return {
+            "content": "".join(node(id) for id in self.children[ROOT]),
+            "unplaced": "".join(node(id) for id, parent in self.parent.items() if parent is None),
+            "style": "\n".join(style).replace("<", "\\3c "),
+            "operations": self._styling() + [op for op in details if not binary(op[1])],
+            "binary_operations": [op for op in details if binary(op[1])]
+        }
+
+    def _detach(self, id):
+        container = self.parent.get(id)
+        if container is not None:
+            self.children[container].remove(id)
+        self.parent[id] = None
+
+    def _insert(self, id, container, index):
+        self._detach(id)
+        self.children[container].insert(index, id)
+        self.parent[id] = container
+
+    # Elements
+    def _create_element(self, id, html):
+        self.elements[id] = {
+            "html": html,
+            "placed": False,
+            "attributes": {},
+            "removed": set(),
+            "style": {},
+            "classes": [],
+            "hidden": False,
+            "events": {},
+            "setup": {},
+            "src": None,
+            "patches": [],
+            "chart": None,
+            "canvas": {} # layer -> chunks of commands since it was last cleared
+        }
+        self.parent[id] = None
+
+    def _add_element(self, id, position=0, anchor_id=""):
+        self.elements[id]["placed"] = True
+        if self.parent[id] is not None: # already part of a group
+            return
+
+        root = self.children[ROOT]
+        if anchor_id and position in (-1, 1) and anchor_id in root:
+            self._insert(id, ROOT, root.index(anchor_id) + (position == 1))
+        else:
+            self._insert(id, ROOT, len(root))
+
+    def _remove_element(self, id):
+        self._detach(id)
+        self.parent.pop(id, None)
+        if id in self.groups: # with all of its members
+            for member in list(self.children[id]):
+                self._remove_element(member)
+            del self.groups[id]
+            del self.children[id]
+        else:
+            self.elements.pop(id, None)
+
+    def _update_attributes(self, id, attributes):
+        self.elements[id]["attributes"].update(attributes)
+        self.elements[id]["removed"].difference_update(attributes)
+
+    def _remove_attributes(self, id, names):
+        for name in names:
+            self.elements[id]["attributes"].pop(name, None)
+        self.elements[id]["removed"].update(names)
+
+    def _update_style(self, id, changes, rule):
+        update_rule(self.elements[id]["style"], rule, changes)
+
+    def _update_class_style(self, name, changes, rule):
+        rules = self.classes.setdefault(name, {})
+        update_rule(rules, rule, changes)
+        if not rules:
+            del self.classes[name]
+
+    def _add_class(self, id, name):
+        if name not in self.elements[id]["classes"]:
+            self.elements[id]["classes"].append(name)
+
+    def _remove_class(self, id, name):
+        if name in self.elements[id]["classes"]:
+            self.elements[id]["classes"].remove(name)
+
+    def _change_visibility(self, id, mode):
+        element = self.elements[id]
+        element["hidden"] = mode == "hide" or (mode == "toggle" and not element["hidden"])
+
+    def _register_event(self, id, event, options=None):
+        self.elements[id]["events"][event] = options
+
+    def _remove_event(self, id, event):
+        self.elements[id]["events"].pop(event, None)
+
+    def _change_src(self, id, mimetype, data, request_id=None):
+        self.elements[id]["src"] = (mimetype, data)
+        self.elements[id]["patches"] = []
+
+    def _patch_src(self, id, mimetype, tiles):
+        self.elements[id]["patches"].append((mimetype, tiles))
+
+    def _chart_append(self, id, data, capacity, offset=0):
+        chart = self.elements[id]["chart"]
+        if chart is None:
+            chart = self.elements[id]["chart"] = {"chunks": deque(), "count": 0, "capacity": capacity}
+        chart["chunks"].append((offset, data))
+        chart["count"] += len(data) // 8
+
+        # Only the newest points fit into the chart
+        while chart["count"] > capacity:
+            first_offset, first = chart["chunks"][0]
+            excess = chart["count"] - capacity
+            if len(first) // 8 <= excess:
+                chart["chunks"].popleft()
+                chart["count"] -= len(first) // 8
+            else:
+                chart["chunks"][0] = (first_offset, first[8 * excess:])
+                chart["count"] = capacity
+
+    def _chart_clear(self, id):
+        self.elements[id]["chart"] = None
+
+    def _canvas_draw(self, id, layers):
+        canvas = self.elements[id]["canvas"]
+        for layer, cleared, commands in layers:
+            if cleared or layer not in canvas:
+                canvas[layer] = {"chunks": deque(), "size": 0}
+            history = canvas[layer]
+            history["chunks"].append(commands)
+            history["size"] += len(commands)
+
+            # Layers that are never cleared only keep their newest drawings
+            while history["size"] > MAX_LAYER_SIZE and len(history["chunks"]) > 1:
+                history["size"] -= len(history["chunks"].popleft())
+                self.dropped += 1
+
+    # Arrangement
+    def _order(self, ids):
+        ids = [id for id in ids if id in self.parent]
+        for first, second in zip(ids, ids[1:]):
+            container = self.parent[first]
+            if container is None:
+                self._detach(second)
+                continue
+            if self.parent[second] == container:
+                self._detach(second)
+            self._insert(second, container, self.children[container].index(first) + 1)
+
+    def _reorder(self, group_id, moves):
+        for id, after in moves:
+            if id not in self.parent:
+                continue
+            self._detach(id)
+            index = self.children[group_id].index(after) + 1 if after in self.children[group_id] else 0
+            self._insert(id, group_id, index)
+
+    def _create_group(self, id, sort):
+        self.groups[id] = {"sort": sort}
+        self.children[id] = []
+        self.parent[id] = None
+        self._insert(id, ROOT, len(self.children[ROOT]))
+
+    def _toggle_sorting(self, id, sort):
+        self.groups[id]["sort"] = sort
+
+    def _add_to_group(self, group_id, member_ids):
+        for id in member_ids:
+            if id not in self.parent:
+                continue
+            self._insert(id, group_id, len(self.children[group_id]))
+
+    def _remove_from_group(self, group_id, member_ids):
+        member_ids = [id for id in member_ids if id in self.parent]
+        container = self.parent[group_id]
+        for id in member_ids:
+            self._detach(id)
+        if container is None:
+            return
+        index = self.children[container].index(group_id) + 1
+        for offset, id in enumerate(member_ids):
+            self._insert(id, container, index + offset)
+
+    def _disband_group(self, id):
+        # The browser moves the members behind the group one by one, which reverses them
+        container = self.parent[id]
+        members = self.children[id][::-1]
+        for member in members:
+            self._detach(member)
+        if container is not None:
+            index = self.children[container].index(id) + 1
+            for offset, member in enumerate(members):
+                self._insert(member, container, index + offset)
+
+        self._detach(id)
+        del self.parent[id]
+        del self.groups[id]
+        del self.children[id]
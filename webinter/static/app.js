@@ -1,12 +1,84 @@
+// The page has been rendered by the server, this identifies the state it was rendered from
+const initial_state = JSON.parse(document.getElementById("initial-state").textContent);
+let initial_token = initial_state.token;
+
 const socket = io(window.location.href, {
-    reconnectionAttempts: 4
+    reconnectionAttempts: 4,
+    auth: (cb) => {
+        // Only the first connection belongs to the rendered page
+        cb({ "state": initial_token });
+        initial_token = null;
+    }
 });
 
 let app = document.getElementById("content");
 let packers = {};
-onmodification = () => Object.values(packers).forEach(packer => packer.fit());
+let layout_suspended = false;
+let layout_pending = false;
+let layout_frame = null;
+onmodification = () => {
+    if (layout_suspended) {
+        layout_pending = true;
+        return;
+    }
+    // Lay out at most once per frame
+    if (layout_frame === null) {
+        layout_frame = requestAnimationFrame(layout);
+    }
+};
+
+function layout() {
+    layout_frame = null;
+    // Nested groups are packed as part of their top level group
+    Object.values(packers).forEach((packer) => {
+        if (packer.container.parentElement === app) {
+            packer.fit();
+        }
+    });
+}
 window.onresize = onmodification;
 
+// Every operation can be received on its own or as part of a batch
+let operations = {};
+function on_operation(event, handler) {
+    operations[event] = handler;
+    socket.on(event, handler);
+}
+
+// Apply all operations of a batch and lay out once afterwards
+function apply_batch(batch) {
+    let nested = layout_suspended;
+    layout_suspended = true;
+    try {
+        batch.forEach(([event, args]) => operations[event](...args));
+    } finally {
+        layout_suspended = nested;
+        if (!nested && layout_pending) {
+            layout_pending = false;
+            onmodification();
+        }
+    }
+}
+socket.on("batch", apply_batch);
+
+// Replaces the whole page with the state of the server (e.g. after reconnecting)
+on_operation("snapshot", (snapshot) => {
+    Object.values(mirrors).forEach((mirror) => clearTimeout(mirror.timeout));
+    mirrors = {};
+    packers = {};
+    custom_styles = {};
+    style_rules = new Map();
+
+    app.replaceChildren();
+    document.getElementById("unplaced-content").replaceChildren();
+    let sheet = document.getElementById("custom-style").sheet;
+    while (sheet.cssRules.length > 0) {
+        sheet.deleteRule(0);
+    }
+
+    apply_batch(snapshot);
+});
+
 function htmlToNode(html) {
     const template = document.createElement('template');
     template.innerHTML = html.trim();
@@ -27,13 +99,13 @@ function base64ToBlob(base64, typestr) {
     return URL.createObjectURL(blob);
 }
 
-socket.on("create_element", (id, html) => {
+on_operation("create_element", (id, html) => {
     let node = htmlToNode(html);
     node.classList.add("element", "unplaced");
     document.getElementById("unplaced-content").appendChild(node);
 });
 
-socket.on("add_element", (id, position, anchor_id) => {
+on_operation("add_element", (id, position, anchor_id) => {
     let node = document.getElementById(id + "-container");
     node.classList.remove("unplaced");
 
@@ -59,8 +131,17 @@ socket.on("add_element", (id, position, anchor_id) => {
     }
 });
 
-socket.on("remove_element", (id) => {
+on_operation("mark_unplaced", (id) => {
+    document.getElementById(id + "-container").classList.add("unplaced");
+});
+
+on_operation("remove_element", (id) => {
     let element = document.getElementById(id);
+    if (id in mirrors) {
+        clearTimeout(mirrors[id].timeout);
+        delete mirrors[id];
+    }
+    remove_rules(id);
     if (!element.classList.contains("group")) {
         element = element.parentElement;
     }
@@ -68,41 +149,108 @@ socket.on("remove_element", (id) => {
     onmodification();
 });
 
-socket.on("register_event", (id, event) => {
-    document.getElementById(id)[`on${event}`] = function (e) {
-        let value = null; // triggers element.get() if null
-        let el = e.target;
-        if (e.type == "click" && el.tagName == "IMG") {
-            // Calculate the offset created by object-fit: contain
-            contain_scaling = Math.min(
-                el.width / el.naturalWidth, el.height / el.naturalHeight
-            );
-            contain_width = el.naturalWidth * contain_scaling;
-            contain_height = el.naturalHeight * contain_scaling;
-            contain_offset_x = Math.floor((el.width - contain_width) / 2);
-            contain_offset_y = Math.floor((el.height - contain_height) / 2);
-
-            let x = Math.floor((e.offsetX - contain_offset_x) / contain_scaling);
-            let y = Math.floor((e.offsetY - contain_offset_y) / contain_scaling);
-            // value = null if point lies outside of the image
-            value = (
-                (x >= 0 && x <= el.naturalWidth) &&
-                (y >= 0 && y <= el.naturalHeight)
-            ) ? [x, y] : null;
+function image_click_value(e) {
+    let el = e.target;
+
+    // Calculate the offset created by object-fit: contain
+    contain_scaling = Math.min(
+        el.width / el.naturalWidth, el.height / el.naturalHeight
+    );
+    contain_width = el.naturalWidth * contain_scaling;
+    contain_height = el.naturalHeight * contain_scaling;
+    contain_offset_x = Math.floor((el.width - contain_width) / 2);
+    contain_offset_y = Math.floor((el.height - contain_height) / 2);
+
+    let x = Math.floor((e.offsetX - contain_offset_x) / contain_scaling);
+    let y = Math.floor((e.offsetY - contain_offset_y) / contain_scaling);
+    // value = null if point lies outside of the image
+    return (
+        (x >= 0 && x <= el.naturalWidth) &&
+        (y >= 0 && y <= el.naturalHeight)
+    ) ? [x, y] : null;
+}
+
+function flush_mirror(id) {
+    // The server has to know the current value before handling the event
+    if (id in mirrors && mirrors[id].timeout !== null) {
+        push_mirror(id);
+    }
+}
+
+on_operation("register_event", (id, event, options) => {
+    let element = document.getElementById(id);
+    clearTimeout(element[`${event}_timeout`]);
+
+    if (!options) {
+        element[`on${event}`] = function (e) {
+            let value = null; // triggers element.get() if null
+            if (e.type == "click" && e.target.tagName == "IMG") {
+                value = image_click_value(e);
+            }
+
+            flush_mirror(id);
+            socket.emit("element_event", event, id, value);
+        };
+        return;
+    }
+
+    // Bursts of events are sent as one message, together with their values
+    let values = [];
+    let burst_start = null;
+    let last_sent = -Infinity;
+
+    let flush = () => {
+        element[`${event}_timeout`] = null;
+        last_sent = performance.now();
+        burst_start = null;
+        flush_mirror(id);
+        socket.emit("element_events", event, id, values);
+        values = [];
+    };
+
+    element[`on${event}`] = function (e) {
+        let value = (e.type == "click" && e.target.tagName == "IMG") ? image_click_value(e) : element_value(element);
+        if (options.latest_only) {
+            values = [value];
+        } else {
+            values.push(value);
+        }
+
+        let now = performance.now();
+        if (burst_start === null) {
+            burst_start = now;
+        }
+
+        let at;
+        if (options.debounce_ms != null) {
+            // Wait for a pause, but not longer than throttle_ms
+            at = now + options.debounce_ms;
+            if (options.throttle_ms != null) {
+                at = Math.min(at, burst_start + options.throttle_ms);
+            }
+        } else {
+            if (element[`${event}_timeout`] != null) {
+                return;
+            }
+            at = Math.max(now, last_sent + options.throttle_ms);
         }
 
-        socket.emit("element_event", event, id, value);
+        clearTimeout(element[`${event}_timeout`]);
+        element[`${event}_timeout`] = setTimeout(flush, at - now);
     };
 });
 
-socket.on("remove_event", (id, event) => {
-    document.getElementById(id)[`on${event}`] = (e) => { };
+on_operation("remove_event", (id, event) => {
+    let element = document.getElementById(id);
+    clearTimeout(element[`${event}_timeout`]);
+    element[`on${event}`] = (e) => { };
 })
 
-function on_get_files(id, files) {
+function on_get_files(id, files, request_id) {
     let data = new FormData();
     data.append("id", id);
     data.append("namespace", window.location.pathname);
+    data.append("request_id", request_id);
 
     for (let file of files) {
         data.append(id, file, file.name);
@@ -114,7 +262,161 @@ function on_get_files(id, files) {
     });
 }
 
+// Files of file inputs are uploaded in chunks, which are sent in parallel and retried on failure
+const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024;
+const UPLOAD_CONCURRENCY = 4;
+const UPLOAD_RETRIES = 5;
+
+function wait_for_connection() {
+    return new Promise((resolve) => {
+        if (socket.connected) {
+            resolve();
+        } else {
+            socket.once("connect", resolve);
+        }
+    });
+}
+
+async function upload_request(url, options) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            let response = await fetch(url, options);
+            if (response.ok) {
+                return response;
+            }
+            if (attempt >= UPLOAD_RETRIES) {
+                throw new Error(`${url}: ${response.status}`);
+            }
+        } catch (error) {
+            if (attempt >= UPLOAD_RETRIES) {
+                throw error;
+            }
+        }
+
+        // Back off and continue once the server is reachable again
+        await new Promise((resolve) => setTimeout(resolve, 250 * 2 ** attempt));
+        await wait_for_connection();
+    }
+}
+
+async function chunk_hash(data) {
+    // crypto.subtle is only available in secure contexts
+    if (!window.crypto || !crypto.subtle) {
+        return "";
+    }
+    let digest = new Uint8Array(await crypto.subtle.digest("SHA-256", data));
+    return Array.from(digest, (byte) => byte.toString(16).padStart(2, "0")).join("");
+}
+
+function upload_json(url, data) {
+    return upload_request(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(data)
+    });
+}
+
+async function upload_file(id, file) {
+    let upload = await (await upload_json("/upload/start", {
+        "id": id,
+        "namespace": window.location.pathname,
+        "name": file.name,
+        "size": file.size,
+        "type": file.type,
+        "last_modified": file.lastModified,
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    })).json();
+
+    // Chunks which already reached the server are skipped
+    let received = new Set(upload.received);
+    let pending = [];
+    for (let index = 0; index * UPLOAD_CHUNK_SIZE < file.size; index++) {
+        if (!received.has(index)) {
+            pending.push(index);
+        }
+    }
+
+    let worker = async () => {
+        while (pending.length > 0) {
+            let index = pending.shift();
+            let data = await file.slice(
+                index * UPLOAD_CHUNK_SIZE, (index + 1) * UPLOAD_CHUNK_SIZE
+            ).arrayBuffer();
+            let params = new URLSearchParams({ "upload_id": upload.upload_id, "index": index });
+
+            await upload_request(`/upload/chunk?${params}`, {
+                method: "POST",
+                headers: { "X-Chunk-Hash": await chunk_hash(data) },
+                body: data
+            });
+        }
+    };
+    await Promise.all(Array.from({ length: UPLOAD_CONCURRENCY }, worker));
+
+    return upload.upload_id;
+}
+
+async function prepare_image(file, options) {
+    if (!options || !file.type.startsWith("image/")) {
+        return file;
+    }
+
+    let bitmap = await createImageBitmap(file, { imageOrientation: "from-image" });
+    let scale = Math.min(
+        1,
+        (options.max_width || Infinity) / bitmap.width,
+        (options.max_height || Infinity) / bitmap.height
+    );
+    let type = options.type || file.type;
+
+    // Re-encoding an image that already fits would only lose quality
+    if (scale == 1 && type == file.type && options.quality == null) {
+        bitmap.close();
+        return file;
+    }
+
+    let canvas = document.createElement("canvas");
+    canvas.width = Math.max(1, Math.round(bitmap.width * scale));
+    canvas.height = Math.max(1, Math.round(bitmap.height * scale));
+    canvas.getContext("2d").drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    let blob = await new Promise((resolve) => canvas.toBlob(resolve, type, options.quality ?? undefined));
+    let base = file.name.includes(".") ? file.name.slice(0, file.name.lastIndexOf(".")) : file.name;
+    return new File([blob], `${base}.${blob.type.split("/")[1]}`, {
+        type: blob.type, lastModified: file.lastModified
+    });
+}
+
+on_operation("upload_options", (id, options) => {
+    document.getElementById(id).upload_options = options;
+});
+
+async function upload_files(id, files, request_id) {
+    try {
+        let options = document.getElementById(id).upload_options;
+        let upload_ids = [];
+        for (let file of files) {
+            upload_ids.push(await upload_file(id, await prepare_image(file, options)));
+        }
+        await upload_json("/upload/finish", {
+            "id": id,
+            "namespace": window.location.pathname,
+            "request_id": request_id,
+            "upload_ids": upload_ids
+        });
+    } catch (error) {
+        console.error(error);
+        socket.emit("element_event", "value_response", id, null, request_id);
+    }
+}
+
 function element_value(element) {
+    // The first visible row, which may be 0
+    if (element.tagName === "DATA-TABLE") {
+        return element.value;
+    }
+
     let value = null;
     switch (element.type) {
         case "checkbox":
@@ -132,33 +434,130 @@ function element_value(element) {
     return value;
 }
 
-socket.on("get_value", (id) => {
+on_operation("get_value", (id, request_id) => {
     let element = document.getElementById(id);
     if (element.type == "file") {
-        on_get_files(id, element.files);
+        upload_files(id, element.files, request_id);
     } else {
         socket.emit(
-            "element_event", "value_response", id, element_value(element)
+            "element_event", "value_response", id, element_value(element), request_id
         );
     }
 })
 
-socket.on("get_drawing_board", (id, res) => {
-    let element = document.getElementById(id);
-    element.get_drawing(res).then((file) => on_get_files(id, [file]));
+on_operation("get_values", (ids, request_id) => {
+    let values = ids.map((id) => element_value(document.getElementById(id)));
+    socket.emit("element_event", "value_response", null, values, request_id);
 })
 
-socket.on("change_src", (id, typestr) => {
+// Elements which push every change of their value to the server
+const MIRROR_DELAY = 50; // ms
+let mirrors = {};
+
+function push_mirror(id) {
+    clearTimeout(mirrors[id].timeout);
+    mirrors[id].timeout = null;
+    socket.emit(
+        "element_event", "value_update", id, element_value(document.getElementById(id))
+    );
+}
+
+on_operation("mirror_value", (id) => {
     let element = document.getElementById(id);
-    fetch('/get_file?' + new URLSearchParams({ "id": id }).toString(), {
-        method: "GET"
-    }).then(res => res.blob()).then(data => {
-        let blob = new Blob([data], { type: typestr });
-        element.src = URL.createObjectURL(blob);
+    mirrors[id] = { "timeout": null };
+
+    element.addEventListener("input", () => {
+        clearTimeout(mirrors[id].timeout);
+        mirrors[id].timeout = setTimeout(() => push_mirror(id), MIRROR_DELAY);
     });
+    element.addEventListener("change", () => push_mirror(id));
+    push_mirror(id);
+});
+
+on_operation("get_drawing_board", (id, res, request_id) => {
+    let element = document.getElementById(id);
+    element.get_drawing(res).then((file) => on_get_files(id, [file], request_id));
 })
 
-socket.on("update_attributes", (id, attributes) => {
+function set_src(element, url) {
+    // Free the previous source
+    if (element.src.startsWith("blob:")) {
+        URL.revokeObjectURL(element.src);
+    }
+    element.src = url;
+}
+
+on_operation("change_src", (id, typestr, data, request_id) => {
+    let element = document.getElementById(id);
+    if (element.canvas) {
+        element.canvas.remove();
+        element.canvas_observer.disconnect();
+        element.canvas = null;
+    }
+
+    // Small files are sent along with the message, others are loaded from their url
+    if (typeof data === "string") {
+        set_src(element, data);
+    } else {
+        set_src(element, URL.createObjectURL(new Blob([data], { type: typestr })));
+    }
+
+    element.src_ready = (element.decode ? element.decode() : Promise.resolve()).catch(() => { });
+    if (request_id) {
+        // Acknowledge the frame of a stream once it is displayed
+        element.src_ready.then(() => {
+            socket.emit("element_event", "value_response", id, null, request_id);
+        });
+    }
+})
+
+function overlay_canvas(element) {
+    // Patched images are shown on a canvas on top of the image, so they don't have to be encoded again
+    let canvas = document.createElement("canvas");
+    canvas.width = element.naturalWidth;
+    canvas.height = element.naturalHeight;
+    canvas.getContext("2d").drawImage(element, 0, 0);
+    canvas.style.position = "absolute";
+    canvas.style.pointerEvents = "none"; // events still reach the image
+
+    let container = element.parentElement;
+    if (getComputedStyle(container).position === "static") {
+        container.style.position = "relative";
+    }
+    let place = () => {
+        canvas.style.left = element.offsetLeft + "px";
+        canvas.style.top = element.offsetTop + "px";
+        canvas.style.width = element.offsetWidth + "px";
+        canvas.style.height = element.offsetHeight + "px";
+    };
+    element.canvas_observer = new ResizeObserver(place);
+    element.canvas_observer.observe(element);
+    element.canvas_observer.observe(container);
+    place();
+
+    element.after(canvas);
+    return canvas;
+}
+
+// Draws changed tiles onto the current image
+on_operation("patch_src", (id, typestr, tiles) => {
+    let element = document.getElementById(id);
+    element.src_ready = (element.src_ready || Promise.resolve()).then(async () => {
+        let bitmaps = await Promise.all(tiles.map(
+            ([x, y, data]) => createImageBitmap(new Blob([data], { type: typestr }))
+        ));
+
+        element.canvas = element.canvas || overlay_canvas(element);
+        let ctx = element.canvas.getContext("2d");
+        bitmaps.forEach((bitmap, i) => {
+            ctx.clearRect(tiles[i][0], tiles[i][1], bitmap.width, bitmap.height);
+            ctx.drawImage(bitmap, tiles[i][0], tiles[i][1]);
+            bitmap.close();
+        });
+    }).catch(() => { });
+})
+
+on_operation("update_attributes", (id, attributes) => {
     let element = document.getElementById(id);
 
     for (let name in attributes) {
@@ -209,10 +608,11 @@ socket.on("update_attributes", (id, attributes) => {
                 element.setAttribute(name, attributes[name]);
         }
     }
+    if (id in mirrors) { push_mirror(id) }
     onmodification();
 })
 
-socket.on("remove_attributes", (id, names) => {
+on_operation("remove_attributes", (id, names) => {
     let element = document.getElementById(id);
     names.forEach((name) => {
         switch (name) {
@@ -246,54 +646,77 @@ socket.on("remove_attributes", (id, names) => {
                 element.removeAttribute(name);
         }
     });
+    if (id in mirrors) { push_mirror(id) }
     onmodification();
 })
 
-var custom_styles = {};
-socket.on("update_style", (id, custom_style, rule) => {
-    let element = document.getElementById(id);
-    let custom = document.getElementById("custom-style");
-    let sheet = custom.sheet;
+var style_rules = new Map(); // selector -> CSSStyleRule
+var custom_styles = {}; // id -> selectors of the rules of the element
 
-    let css_rule = rule.replaceAll("<self>", `[id='${id}'].custom-style`);
+// Applies the changed properties to a rule, returns whether it still has any
+function update_rule(selector, changes) {
+    let sheet = document.getElementById("custom-style").sheet;
+    let rule = style_rules.get(selector);
+    if (rule === undefined) {
+        rule = sheet.cssRules[sheet.insertRule(selector + "{}", sheet.cssRules.length)];
+        style_rules.set(selector, rule);
+    }
 
-    if (Object.keys(custom_style).length == 0 && css_rule in custom_styles) {
-        let idx = custom_styles[css_rule]["idx"];
-        delete custom_styles[css_rule];
-        Object.keys(custom_styles).forEach((k) => {
-            if (custom_styles[k]["idx"] > idx) {
-                --custom_styles[k]["idx"];
-            }
-        });
-        sheet.deleteRule(idx);
-        for (v of Object.values(custom_styles)) {
-            if (v["id"] == id) {
-                return;
-            }
-        }
-        element.classList.remove("custom-style");
-        return;
+    Object.entries(changes).forEach(([k, v]) => rule.style[k] = (v === null) ? "" : v);
+
+    if (rule.style.length == 0) {
+        delete_rule(selector);
+        return false;
     }
-    if (!(css_rule in custom_styles)) {
-        custom_styles[css_rule] = { "idx": Object.keys(custom_styles).length, "style": {}, "id": id };
-        sheet.insertRule(css_rule + "{}", custom_styles[css_rule]["idx"]);
-        element.classList.add("custom-style");
+    return true;
+}
+
+function delete_rule(selector) {
+    let sheet = document.getElementById("custom-style").sheet;
+    let rule = style_rules.get(selector);
+    if (rule !== undefined) {
+        sheet.deleteRule(Array.prototype.indexOf.call(sheet.cssRules, rule));
+        style_rules.delete(selector);
     }
+}
 
-    let removed = Object.keys(custom_styles[css_rule]["style"]).filter((k) => k in custom_style);
-    custom_styles[css_rule]["style"] = custom_style;
+function remove_rules(id) {
+    (custom_styles[id] || []).forEach(delete_rule);
+    delete custom_styles[id];
+}
 
-    let style = sheet.cssRules[custom_styles[css_rule]["idx"]].style;
-    Object.keys(custom_style).forEach((k) => {
-        if (k in removed) {
-            style[k] = "";
-        } else {
-            style[k] = custom_style[k];
-        }
-    });
+on_operation("update_style", (id, changes, rule) => {
+    let selector = rule.replaceAll("<self>", `[id='${id}'].custom-style`);
+    let selectors = custom_styles[id] ??= new Set();
+
+    if (update_rule(selector, changes)) {
+        selectors.add(selector);
+    } else {
+        selectors.delete(selector);
+    }
+    document.getElementById(id).classList.toggle("custom-style", selectors.size > 0);
+    if (selectors.size == 0) {
+        delete custom_styles[id];
+    }
+    onmodification();
 })
 
-socket.on("change_visibility", (id, mode) => {
+on_operation("update_class_style", (name, changes, rule) => {
+    update_rule(rule.replaceAll("<class>", "." + CSS.escape(name)), changes);
+    onmodification();
+})
+
+on_operation("add_class", (id, name) => {
+    document.getElementById(id).classList.add(name);
+    onmodification();
+})
+
+on_operation("remove_class", (id, name) => {
+    document.getElementById(id).classList.remove(name);
+    onmodification();
+})
+
+on_operation("change_visibility", (id, mode) => {
     let element = document.getElementById(id + "-container");
     switch (mode) {
         case "show":
@@ -310,17 +733,38 @@ socket.on("change_visibility", (id, mode) => {
     onmodification();
 });
 
-socket.on("clear_drawing_board", (id) => {
+// Tables request the rows they are about to show
+document.addEventListener("rowrequest", (e) => {
+    socket.emit("element_event", "row_request", e.target.id, e.detail);
+});
+
+on_operation("table_rows", (id, version, page, rows) => {
+    document.getElementById(id).set_rows(version, page, rows);
+})
+
+on_operation("chart_append", (id, data, capacity, offset) => {
+    document.getElementById(id).append(data, offset);
+})
+
+on_operation("chart_clear", (id) => {
+    document.getElementById(id).clear();
+})
+
+on_operation("canvas_draw", (id, layers) => {
+    document.getElementById(id).draw(layers);
+})
+
+on_operation("clear_drawing_board", (id) => {
     let element = document.getElementById(id);
     element.clear();
 });
 
-socket.on("undo_drawing_board", (id) => {
+on_operation("undo_drawing_board", (id) => {
     let element = document.getElementById(id);
     element.undo_last_stroke();
 });
 
-socket.on("order", (ordered_ids) => {
+on_operation("order", (ordered_ids) => {
     for (let i = 0; i < ordered_ids.length - 1; i++) {
         let first = document.getElementById(ordered_ids[i]);
         if (!first.classList.contains("group")) {
@@ -337,7 +781,24 @@ socket.on("order", (ordered_ids) => {
     onmodification();
 });
 
-socket.on("create_group", (id, sort) => {
+// Moves members behind their new predecessor (or to the front)
+on_operation("reorder", (group_id, moves) => {
+    let group = document.getElementById(group_id);
+    moves.forEach(([id, after_id]) => {
+        let node = document.getElementById(id);
+        if (!node.classList.contains("group")) {
+            node = node.parentElement;
+        }
+        let after = after_id ? document.getElementById(after_id) : null;
+        if (after && !after.classList.contains("group")) {
+            after = after.parentElement;
+        }
+        group.insertBefore(node, after ? after.nextSibling : group.firstChild);
+    });
+    onmodification();
+});
+
+on_operation("create_group", (id, sort) => {
     let group = document.createElement("div");
     group.id = id;
     if (sort) { group.setAttribute("sort", "") };
@@ -346,14 +807,14 @@ socket.on("create_group", (id, sort) => {
     packers[id] = new Packer(group);
 });
 
-socket.on("toggle_sorting", (id, new_sort) => {
+on_operation("toggle_sorting", (id, new_sort) => {
     let group = document.getElementById(id);
     if (new_sort) { group.setAttribute("sort", "") }
     else { group.removeAttribute("sort") }
     onmodification();
 })
 
-socket.on("add_to_group", (group_id, member_ids) => {
+on_operation("add_to_group", (group_id, member_ids) => {
     let group = document.getElementById(group_id);
     member_ids.forEach((id) => {
         let element = document.getElementById(id);
@@ -366,7 +827,7 @@ socket.on("add_to_group", (group_id, member_ids) => {
     onmodification();
 })
 
-socket.on("remove_from_group", (group_id, member_ids) => {
+on_operation("remove_from_group", (group_id, member_ids) => {
     let group = document.getElementById(group_id);
     member_ids.reverse();
     member_ids.forEach((id) => {
@@ -379,7 +840,7 @@ socket.on("remove_from_group", (group_id, member_ids) => {
     onmodification();
 });
 
-socket.on("disband_group", (id) => {
+on_operation("disband_group", (id) => {
     let group = document.getElementById(id);
     [...group.childNodes].forEach((child) => {
         group.parentElement.insertBefore(child, group.nextSibling);
@@ -389,9 +850,9 @@ socket.on("disband_group", (id) => {
     onmodification();
 });
 
-socket.on("alert", (msg) => { alert(msg) });
+on_operation("alert", (msg) => { alert(msg) });
 
-socket.on("download", (id, filename) => {
+on_operation("download", (id, filename) => {
     fetch('/get_file?' + new URLSearchParams({ "id": id }).toString(), {
         method: "GET"
     }).then(res => res.blob()).then(data => {
@@ -410,7 +871,7 @@ socket.on("download", (id, filename) => {
     });
 })
 
-socket.on("open_url", (url, open_new_tab) => {
+on_operation("open_url", (url, open_new_tab) => {
     let link = document.createElement("a");
     link.href = url;
 
@@ -424,7 +885,7 @@ socket.on("open_url", (url, open_new_tab) => {
     document.body.removeChild(link);
 })
 
-socket.on("shutdown", () => {
+on_operation("shutdown", () => {
     socket.disconnect();
 
     setTimeout(() => {
@@ -433,7 +894,7 @@ socket.on("shutdown", () => {
     }, 200);
 });
 
-socket.on("disconnect_client", (msg) => {
+on_operation("disconnect_client", (msg) => {
     socket.disconnect();
 
     setTimeout(() => {
@@ -452,4 +913,12 @@ socket.on("disconnect_client", (msg) => {
 
 window.onerror = (msg, url, line) => {
     socket.emit("error", msg);
-};
\ No newline at end of file
+};
+
+// Attach to the rendered page
+document.querySelectorAll("#app .group").forEach((group) => {
+    packers[group.id] = new Packer(group);
+});
+apply_batch(initial_state.operations);
+document.getElementById("initial-style").remove();
+onmodification();
@@ -0,0 +1,180 @@
+// Opcodes of the recorded commands, see Canvas in elements.py
+const CANVAS_STYLE = 0;
+const CANVAS_RECT = 1;
+const CANVAS_LINE = 2;
+const CANVAS_PATH = 3;
+const CANVAS_TEXT = 4;
+const CANVAS_IMAGE = 5;
+
+class CommandCanvas extends HTMLElement {
+    static get observedAttributes() {
+        return ["width", "height"];
+    }
+
+    constructor(default_width = 400, default_height = 300) {
+        super();
+
+        this.default_width = default_width;
+        this.default_height = default_height;
+
+        this.layers = []; // one canvas per layer, stacked on top of each other
+        this.queues = []; // commands of a layer are drawn in order, even if images have to be decoded first
+        this.decoder = new TextDecoder();
+    }
+
+    connectedCallback() {
+        // Moving the element (e.g. into a group) connects it again
+        if (this.root) {
+            return;
+        }
+
+        // Create shadow dom
+        this.root = this.attachShadow({ mode: "open" });
+        let style = document.createElement("style");
+        style.textContent = `
+            :host { display: block; }
+            .layers { position: relative; width: 100%; height: 100%; }
+            canvas { position: absolute; left: 0; top: 0; width: 100%; height: 100%; }
+        `;
+        this.wrapper = document.createElement("div");
+        this.wrapper.classList.add("layers");
+        this.wrapper.append(...this.layers.map((ctx) => ctx.canvas));
+        this.root.append(style, this.wrapper);
+        this._keep_aspect_ratio();
+    }
+
+    attributeChangedCallback(name, old_value, new_value) {
+        // Resizing a canvas clears it
+        this.layers.forEach((ctx) => this._resize(ctx.canvas));
+        this._keep_aspect_ratio();
+    }
+
+    _keep_aspect_ratio() {
+        let width = parseInt(this.getAttribute("width")) || this.default_width;
+        let height = parseInt(this.getAttribute("height")) || this.default_height;
+        this.style.aspectRatio = `${width} / ${height}`;
+    }
+
+    _resize(canvas) {
+        canvas.width = parseInt(this.getAttribute("width")) || this.default_width;
+        canvas.height = parseInt(this.getAttribute("height")) || this.default_height;
+
+        // Resizing also resets the context, the style of the layer still applies to later commands
+        let ctx = canvas.getContext("2d");
+        ctx.textBaseline = "top";
+        if (ctx.style) {
+            [ctx.fillStyle, ctx.lineWidth] = ctx.style;
+            ctx.strokeStyle = ctx.fillStyle;
+        }
+    }
+
+    _layer(index) {
+        while (this.layers.length <= index) {
+            let canvas = document.createElement("canvas");
+            this._resize(canvas);
+            this.layers.push(canvas.getContext("2d"));
+            this.queues.push(Promise.resolve());
+            if (this.wrapper) {
+                this.wrapper.appendChild(canvas);
+            }
+        }
+        return this.layers[index];
+    }
+
+    draw(layers) {
+        layers.forEach(([index, clear, buffer]) => {
+            let ctx = this._layer(index);
+            this.queues[index] = this.queues[index]
+                .then(() => this._replay(ctx, clear, buffer))
+                .catch((error) => console.error(error));
+        });
+    }
+
+    async _replay(ctx, clear, buffer) {
+        if (clear) {
+            ctx.clearRect(0, 0, ctx.canvas.width, ctx.canvas.height);
+        }
+
+        let view = new DataView(buffer);
+        let offset = 0;
+        let f32 = () => { offset += 4; return view.getFloat32(offset - 4, true); };
+        let string = (length) => {
+            offset += length;
+            return this.decoder.decode(new Uint8Array(buffer, offset - length, length));
+        };
+
+        while (offset < view.byteLength) {
+            let opcode = view.getUint8(offset++);
+            switch (opcode) {
+                case CANVAS_STYLE: {
+                    let [r, g, b, a] = new Uint8Array(buffer, offset, 4);
+                    offset += 4;
+                    ctx.fillStyle = ctx.strokeStyle = `rgba(${r}, ${g}, ${b}, ${a / 255})`;
+                    ctx.lineWidth = f32();
+                    ctx.style = [ctx.fillStyle, ctx.lineWidth];
+                    break;
+                }
+                case CANVAS_RECT: {
+                    let [x, y, w, h] = [f32(), f32(), f32(), f32()];
+                    if (view.getUint8(offset++)) {
+                        ctx.fillRect(x, y, w, h);
+                    } else {
+                        ctx.strokeRect(x, y, w, h);
+                    }
+                    break;
+                }
+                case CANVAS_LINE: {
+                    ctx.beginPath();
+                    ctx.moveTo(f32(), f32());
+                    ctx.lineTo(f32(), f32());
+                    ctx.stroke();
+                    break;
+                }
+                case CANVAS_PATH: {
+                    let flags = view.getUint8(offset++);
+                    let n = view.getUint32(offset, true);
+                    offset += 4;
+                    ctx.beginPath();
+                    for (let i = 0; i < n; i++) {
+                        ctx.lineTo(f32(), f32());
+                    }
+                    if (flags & 1) {
+                        ctx.closePath();
+                    }
+                    if (flags & 2) {
+                        ctx.fill();
+                    } else {
+                        ctx.stroke();
+                    }
+                    break;
+                }
+                case CANVAS_TEXT: {
+                    let [x, y] = [f32(), f32()];
+                    let font_length = view.getUint16(offset, true);
+                    offset += 2;
+                    ctx.font = string(font_length);
+                    let text_length = view.getUint32(offset, true);
+                    offset += 4;
+                    ctx.fillText(string(text_length), x, y);
+                    break;
+                }
+                case CANVAS_IMAGE: {
+                    let [x, y] = [f32(), f32()];
+                    let type_length = view.getUint16(offset, true);
+                    offset += 2;
+                    let type = string(type_length);
+                    let length = view.getUint32(offset, true);
+                    offset += 4;
+                    let blob = new Blob([new Uint8Array(buffer, offset, length)], { "type": type });
+                    offset += length;
+                    ctx.drawImage(await createImageBitmap(blob), x, y);
+                    break;
+                }
+                default:
+                    throw new Error(`Unknown canvas command ${opcode}`);
+            }
+        }
+    }
+}
+
+customElements.define("command-canvas", CommandCanvas);
@@ -0,0 +1,222 @@
+class LiveChart extends HTMLElement {
+    static get observedAttributes() {
+        return ["kind", "capacity", "color"];
+    }
+
+    constructor(default_capacity = 10000, default_color = "steelblue", headroom = 0.1) {
+        super();
+
+        this.default_capacity = default_capacity;
+        this.default_color = default_color;
+        this.headroom = headroom; // share of the axes kept free, so new points can be drawn without a redraw
+
+        this.capacity = default_capacity;
+        this.points = new Float64Array(2 * default_capacity); // ring buffer of x, y pairs
+        this.start = 0;
+        this.count = 0;
+        this.drawn = 0; // points already on the canvas
+        this.range = null;
+        this.redraw = true;
+        this.frame = null;
+    }
+
+    connectedCallback() {
+        // Moving the element (e.g. into a group) connects it again
+        if (this.root) {
+            this._schedule(true);
+            return;
+        }
+
+        // Create shadow dom
+        this.root = this.attachShadow({ mode: "open" });
+        let style = document.createElement("style");
+        style.textContent = ":host { display: block; } canvas { width: 100%; height: 100%; display: block; }";
+        this.canvas = document.createElement("canvas");
+        this.root.append(style, this.canvas);
+
+        this.resize_observer = new ResizeObserver(() => this._schedule(true));
+        this.resize_observer.observe(this.canvas);
+
+        this._read_attributes();
+    }
+
+    attributeChangedCallback(name, old_value, new_value) {
+        if (this.root) {
+            this._read_attributes();
+        }
+    }
+
+    _read_attributes() {
+        this.kind = this.getAttribute("kind") || "line";
+        this.color = this.getAttribute("color") || this.default_color;
+
+        let capacity = parseInt(this.getAttribute("capacity")) || this.default_capacity;
+        if (capacity != this.capacity) {
+            let points = this._ordered().slice(-2 * capacity);
+            this.capacity = capacity;
+            this.points = new Float64Array(2 * capacity);
+            this.points.set(points);
+            this.start = 0;
+            this.count = points.length / 2;
+        }
+        this._schedule(true);
+    }
+
+    // Points from the oldest to the newest
+    _ordered() {
+        let first = this.points.subarray(2 * this.start, 2 * Math.min(this.start + this.count, this.capacity));
+        let wrapped = this.points.subarray(0, 2 * Math.max(this.start + this.count - this.capacity, 0));
+        let points = new Float64Array(first.length + wrapped.length);
+        points.set(first);
+        points.set(wrapped, first.length);
+        return points;
+    }
+
+    append(buffer, offset = 0) {
+        // x is sent relative to the offset
+        let points = Float64Array.from(new Float32Array(buffer));
+        for (let i = 0; i < points.length; i += 2) {
+            points[i] += offset;
+        }
+        let n = points.length / 2;
+        if (n > this.capacity) {
+            points = points.subarray(2 * (n - this.capacity));
+            n = this.capacity;
+        }
+
+        // Old points are overwritten once the buffer is full
+        let end = (this.start + this.count) % this.capacity;
+        let first = Math.min(n, this.capacity - end);
+        this.points.set(points.subarray(0, 2 * first), 2 * end);
+        this.points.set(points.subarray(2 * first), 0);
+
+        let overflow = Math.max(this.count + n - this.capacity, 0);
+        this.start = (this.start + overflow) % this.capacity;
+        this.count = Math.min(this.count + n, this.capacity);
+        this.drawn -= overflow;
+
+        // Removed points are still on the canvas
+        this._schedule(overflow > 0);
+    }
+
+    clear() {
+        this.start = 0;
+        this.count = 0;
+        this.drawn = 0;
+        this._schedule(true);
+    }
+
+    _schedule(redraw = false) {
+        this.redraw = this.redraw || redraw;
+        if (this.frame === null) {
+            this.frame = requestAnimationFrame(() => {
+                this.frame = null;
+                this._draw();
+            });
+        }
+    }
+
+    _fits(points) {
+        for (let i = 0; i < points.length; i += 2) {
+            if (points[i] < this.range.x0 || points[i] > this.range.x1 || points[i + 1] < this.range.y0 || points[i + 1] > this.range.y1) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    _draw() {
+        let width = Math.round(this.canvas.clientWidth * devicePixelRatio);
+        let height = Math.round(this.canvas.clientHeight * devicePixelRatio);
+        if (width == 0 || height == 0) {
+            return;
+        }
+        let points = this._ordered();
+        let ctx = this.canvas.getContext("2d");
+
+        // Only draw the new points if they fit into the current axes
+        let from = 0;
+        if (!this.redraw && this.range && this.drawn > 0 && this.canvas.width == width && this.canvas.height == height) {
+            from = this.drawn - 1; // connect to the last drawn point
+            if (!this._fits(points.subarray(2 * from))) {
+                from = 0;
+            }
+        }
+        if (from == 0) {
+            this.canvas.width = width;
+            this.canvas.height = height;
+            this.range = this._range(points);
+        }
+        this.redraw = false;
+        this.drawn = this.count;
+
+        let { x0, x1, y0, y1 } = this.range;
+        let sx = (width - 1) / ((x1 - x0) || 1);
+        let sy = (height - 1) / ((y1 - y0) || 1);
+        ctx.strokeStyle = ctx.fillStyle = this.color;
+        ctx.lineWidth = devicePixelRatio;
+
+        if (this.kind == "scatter") {
+            // Draw every pixel only once
+            let filled = new Uint8Array(width * height);
+            for (let i = 2 * from; i < points.length; i += 2) {
+                let px = Math.round((points[i] - x0) * sx);
+                let py = Math.round((y1 - points[i + 1]) * sy);
+                if (!filled[py * width + px]) {
+                    filled[py * width + px] = 1;
+                    ctx.fillRect(px - devicePixelRatio, py - devicePixelRatio, 2 * devicePixelRatio, 2 * devicePixelRatio);
+                }
+            }
+            return;
+        }
+
+        // Points within the same pixel column are reduced to their minimum and maximum
+        ctx.beginPath();
+        let column = null;
+        let min, max, last;
+        for (let i = 2 * from; i < points.length; i += 2) {
+            let px = Math.round((points[i] - x0) * sx);
+            let py = (y1 - points[i + 1]) * sy;
+            if (px !== column) {
+                if (column === null) {
+                    ctx.moveTo(px, py);
+                } else {
+                    ctx.lineTo(column, min);
+                    ctx.lineTo(column, max);
+                    ctx.lineTo(column, last);
+                }
+                column = px;
+                min = max = py;
+            }
+            min = Math.min(min, py);
+            max = Math.max(max, py);
+            last = py;
+        }
+        if (column !== null) {
+            ctx.lineTo(column, min);
+            ctx.lineTo(column, max);
+            ctx.lineTo(column, last);
+        }
+        ctx.stroke();
+    }
+
+    _range(points) {
+        let x0 = Infinity, x1 = -Infinity, y0 = Infinity, y1 = -Infinity;
+        for (let i = 0; i < points.length; i += 2) {
+            x0 = Math.min(x0, points[i]);
+            x1 = Math.max(x1, points[i]);
+            y0 = Math.min(y0, points[i + 1]);
+            y1 = Math.max(y1, points[i + 1]);
+        }
+        if (points.length == 0) {
+            return { "x0": 0, "x1": 1, "y0": 0, "y1": 1 };
+        }
+
+        // Leave room for new points
+        let dx = (x1 - x0) * this.headroom;
+        let dy = (y1 - y0) * this.headroom / 2;
+        return { "x0": x0, "x1": x1 + dx, "y0": y0 - dy, "y1": y1 + dy };
+    }
+}
+
+customElements.define("live-chart", LiveChart);
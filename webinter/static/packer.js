@@ -1,18 +1,41 @@
 function Packer(container) {
     this.container = container;
+    this.cache = new Map(); // group id -> {"signature", "packed"} of its last arrangement
 }
 
+// Describes everything the arrangement of a group depends on
+Packer.prototype.signature = function (block, max_width) {
+    let parts = [max_width, block.sort];
+    block.blocks.forEach((child) => {
+        parts.push(child.group ? `[${child.id}:${this.signature(child, max_width)}]` : `${child.id}:${child.w}:${child.h}`);
+    });
+    return parts.join(",");
+};
+
+// Packs a group, unless it hasn't changed since it was last packed
+Packer.prototype.pack_group = function (block, max_width) {
+    let signature = this.signature(block, max_width);
+    let cached = this.cache.get(block.id);
+    if (cached && cached.signature === signature) {
+        return { "blocks": cached.packed.blocks, "root": cached.packed.root, "cached": true };
+    }
+
+    let packed = this.pack(block.blocks, max_width, block.sort);
+    this.cache.set(block.id, { "signature": signature, "packed": packed });
+    return packed;
+};
+
 Packer.prototype.pack = function (blocks, max_width, sort = true) {
-    blocks = structuredClone(blocks);
+    blocks = blocks.slice();
 
     // Pack groups
-    for (let i = 0; i < blocks.length; i++) {
-        let block = blocks[i];
+    for (let block of blocks) {
         if (block.group) {
-            packed_group = this.pack(block.blocks, max_width, block.sort);
-            blocks[i].w = packed_group.root.w;
-            blocks[i].h = packed_group.root.h;
-            blocks[i].blocks = packed_group.blocks;
+            let packed_group = this.pack_group(block, max_width);
+            block.w = packed_group.root.w;
+            block.h = packed_group.root.h;
+            block.blocks = packed_group.blocks;
+            block.cached = packed_group.cached;
         }
     }
 
@@ -164,7 +187,10 @@ Packer.prototype.place_blocks = function (blocks) {
         if (block.group) {
             element.style.width = block.w + "px";
             element.style.height = block.h + "px";
-            this.place_blocks(block.blocks);
+            // The members of an unchanged group are still in place
+            if (!block.cached) {
+                this.place_blocks(block.blocks);
+            }
         }
     });
 };
@@ -183,13 +209,17 @@ Packer.prototype.fit = function () {
     let max_width = window.innerWidth * (
         parseFloat(container_style.getPropertyValue("--max-content-width")) / 100
     );
-    let blocks = this.elements_to_blocks(elements);
-    let arrangement = this.pack(blocks, max_width, this.container.hasAttribute("sort"));
-
-    this.container.style.width = arrangement.root.w + "px";
-    this.container.style.height = arrangement.root.h + "px";
-
-    this.place_blocks(arrangement.blocks);
+    let arrangement = this.pack_group({
+        "id": this.container.id,
+        "blocks": this.elements_to_blocks(elements),
+        "sort": this.container.hasAttribute("sort")
+    }, max_width);
+
+    if (!arrangement.cached) {
+        this.container.style.width = arrangement.root.w + "px";
+        this.container.style.height = arrangement.root.h + "px";
+        this.place_blocks(arrangement.blocks);
+    }
 
     return arrangement.root.fit;
 }
\ No newline at end of file
@@ -0,0 +1,170 @@
+class DataTable extends HTMLElement {
+    static get observedAttributes() {
+        return ["length", "page_size", "version", "columns", "row_height"];
+    }
+
+    constructor(default_row_height = 24, default_page_size = 100, prefetch_pages = 1, max_pages = 16, max_height = 10000000) {
+        super();
+
+        this.default_row_height = default_row_height;
+        this.default_page_size = default_page_size;
+        this.prefetch_pages = prefetch_pages;
+        this.max_pages = max_pages;
+        this.max_height = max_height; // browsers limit the height of elements, longer tables scroll proportionally
+
+        this.pages = new Map(); // page -> rows
+        this.requested = new Set(); // pages which have been requested but not received yet
+        this.first_row = 0;
+        this.frame = null;
+    }
+
+    connectedCallback() {
+        // Moving the element (e.g. into a group) connects it again
+        if (this.root) {
+            this._schedule();
+            return;
+        }
+
+        // Create shadow dom
+        this.root = this.attachShadow({ mode: "open" });
+        let style = document.createElement("style");
+        style.textContent = `
+            :host { display: flex; flex-direction: column; overflow: hidden; }
+            .header, .row { display: grid; grid-auto-columns: minmax(0, 1fr); grid-auto-flow: column; }
+            .header { font-weight: bold; border-bottom: 1px solid black; }
+            .scroller { position: relative; flex: 1; min-height: 0; overflow-y: auto; }
+            .rows { position: absolute; left: 0; right: 0; }
+            .row > div, .header > div { padding: 0px 0.5em; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+            .loading { color: gray; }
+        `;
+        this.header = document.createElement("div");
+        this.header.classList.add("header");
+        this.scroller = document.createElement("div");
+        this.scroller.classList.add("scroller");
+        this.spacer = document.createElement("div");
+        this.rows = document.createElement("div");
+        this.rows.classList.add("rows");
+        this.scroller.append(this.spacer, this.rows);
+        this.root.append(style, this.header, this.scroller);
+
+        // Only the visible rows exist, they are replaced on scroll
+        this.scroller.addEventListener("scroll", () => this._schedule());
+        this.resize_observer = new ResizeObserver(() => this._schedule());
+        this.resize_observer.observe(this.scroller);
+
+        this._read_attributes();
+    }
+
+    attributeChangedCallback(name, old_value, new_value) {
+        if (!this.root) {
+            return;
+        }
+        if (name == "version" || name == "page_size") {
+            // The data changed, all received rows are outdated
+            this.pages.clear();
+            this.requested.clear();
+        }
+        this._read_attributes();
+    }
+
+    _read_attributes() {
+        this.length = parseInt(this.getAttribute("length")) || 0;
+        this.page_size = parseInt(this.getAttribute("page_size")) || this.default_page_size;
+        this.row_height = parseInt(this.getAttribute("row_height")) || this.default_row_height;
+        this.version = this.getAttribute("version");
+
+        let columns = JSON.parse(this.getAttribute("columns") || "null") || [];
+        this.header.replaceChildren(...columns.map((column) => {
+            let cell = document.createElement("div");
+            cell.textContent = column;
+            return cell;
+        }));
+        this.header.style.display = columns.length ? "" : "none";
+
+        this.spacer.style.height = Math.min(this.length * this.row_height, this.max_height) + "px";
+        this._schedule();
+    }
+
+    // Index of the first visible row
+    get value() {
+        return this.first_row;
+    }
+
+    _schedule() {
+        if (this.frame === null) {
+            this.frame = requestAnimationFrame(() => {
+                this.frame = null;
+                this._render();
+            });
+        }
+    }
+
+    _render() {
+        // Map the scroll position onto the full height of all rows
+        let scroll_top = this.scroller.scrollTop;
+        let visible_height = this.scroller.clientHeight;
+        let height = Math.min(this.length * this.row_height, this.max_height);
+        let progress = Math.min(scroll_top / Math.max(height - visible_height, 1), 1);
+        let offset = progress * Math.max(this.length * this.row_height - visible_height, 0);
+
+        let first = Math.min(Math.floor(offset / this.row_height), Math.max(this.length - 1, 0));
+        let last = Math.min(this.length, first + Math.ceil(visible_height / this.row_height) + 1);
+        this.first_row = first;
+
+        // Request the visible pages and their neighbours
+        let first_page = Math.max(Math.floor(first / this.page_size) - this.prefetch_pages, 0);
+        let last_page = Math.min(
+            Math.floor(Math.max(last - 1, 0) / this.page_size) + this.prefetch_pages,
+            Math.ceil(this.length / this.page_size) - 1
+        );
+        for (let page = first_page; page <= last_page; page++) {
+            if (!this.pages.has(page) && !this.requested.has(page)) {
+                this.requested.add(page);
+                this.dispatchEvent(new CustomEvent("rowrequest", { "detail": page, "bubbles": true }));
+            }
+        }
+
+        // Forget pages that are far away
+        if (this.pages.size > this.max_pages) {
+            for (let page of this.pages.keys()) {
+                if (page < first_page || page > last_page) {
+                    this.pages.delete(page);
+                }
+            }
+        }
+
+        let rows = [];
+        for (let i = first; i < last; i++) {
+            let page = this.pages.get(Math.floor(i / this.page_size));
+            let row = document.createElement("div");
+            row.classList.add("row");
+            row.style.height = this.row_height + "px";
+            row.style.lineHeight = this.row_height + "px";
+
+            let cells = (page) ? page[i % this.page_size] || [] : ["…"];
+            if (!page) {
+                row.classList.add("loading");
+            }
+            row.append(...cells.map((value) => {
+                let cell = document.createElement("div");
+                cell.textContent = value;
+                return cell;
+            }));
+            rows.push(row);
+        }
+        this.rows.replaceChildren(...rows);
+        this.rows.style.top = scroll_top - (offset - first * this.row_height) + "px";
+    }
+
+    set_rows(version, page, rows) {
+        // Rows of outdated data are dropped
+        if (version !== this.version) {
+            return;
+        }
+        this.requested.delete(page);
+        this.pages.set(page, rows);
+        this._schedule();
+    }
+}
+
+customElements.define("data-table", DataTable);